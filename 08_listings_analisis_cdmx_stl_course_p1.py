@@ -7,11 +7,45 @@
 ##
 # Utilerías del proyecto
 ##
-from os import ST_WRITE
+import os
+
+import numpy as np
 from utils import *
+from aggregates import (group_index, null_counts, null_density, relabel, rollup,
+                        select_rows, top_n)
+from cleaning import apply_rules, normalize_categories
+from summaries import box_stats, describe_summary, group_stats
+from loaders import (ABB_SNAPSHOT, BOUNDARIES_PATH, DENUE_PATH, file_hash, load_denue, prefetch_listings,
+                     read_manifest, read_preview, shared_view, wait_listings)
+from maps import GRID_LEVELS, GRID_ZOOM, grid_deck, point_deck
+from pipeline import materialize, materialize_all, node_keys
+from proximity import PROXIMITY_RADIUS_M, competition_kpis
+
+# Medición por sección (APP_PROFILE=1 o ?debug=1), ver utils.py
+profile_start()
+mark('Inicio')
 
-# Biblioteca local
-import geopandas as gpd
+##
+# Carga anticipada de los listings de AirBnB
+##
+# La carga se lanza en segundo plano desde ahora y la sección de AirBnB la
+# espera hasta ABB_TIMEOUT segundos; mientras tanto se despliega la parte del DENUE.
+# El snapshot se elige con la variable de ambiente ABB_SNAPSHOT y el origen de
+# la descarga (archivo o URL) con ABB_SOURCE. Para actualizarlo:
+#   python loaders.py refresh mexico-city/2021-12-25
+abb_snapshot = os.environ.get('ABB_SNAPSHOT', ABB_SNAPSHOT)
+ABB_TIMEOUT = float(os.environ.get('ABB_TIMEOUT', 30))
+
+@st.cache_resource()
+def get_data(snapshot, version):
+    # version (hash del manifiesto) invalida el caché cuando se actualiza el snapshot
+    return prefetch_listings(snapshot)
+
+manifest = read_manifest(abb_snapshot)
+abb_future = get_data(abb_snapshot, manifest and manifest['sha256'])
+if abb_future.done() and abb_future.exception() is not None:
+    # No guardamos cargas fallidas, se reintenta en la siguiente ejecución
+    get_data.clear()
 
 header("9 casos de negocio con Streamlit")
 st.subheader("8. Análisis de alojamientos temporales en la CDMX. Parte 1.")
@@ -59,14 +93,56 @@ st.markdown("""
     alojamientos temporales. Con ellos se construyó el _dataset_que usaremos en esta sesión.
 
 """)
-pd_hoteles = pd.read_csv('data/denue_hoteles_cdmx_2020.csv', sep='|')
+##
+# Carga del DENUE
+##
+# Solamente se leen las columnas que usamos, con tipos explícitos. El resultado
+# se guarda en un Parquet ligado al contenido del CSV (ver loaders.py).
+# Los dataframes base se guardan una sola vez por proceso (cache_resource, sin
+# copiarlos para cada sesión) y cada sesión usa una vista (shared_view).
+@st.cache_resource()
+def get_denue(csv_hash):
+    return load_denue(DENUE_PATH)
+
+@st.cache_data()
+def get_denue_preview(csv_hash):
+    return read_preview(DENUE_PATH, nrows=10)
+
+##
+# Cubo de conteos del DENUE
+##
+# Se cuentan los establecimientos una sola vez por colonia x alcaldía x actividad;
+# todas las tablas y gráficos de barras de esta parte se agregan a partir de él.
+# Este y los demás datasets derivados son nodos de pipeline.py: se guardan
+# ligados al contenido de sus entradas y se recalculan solamente si estas cambian.
+# El caché en memoria de cada uno va ligado a las llaves de sus nodos (`keys`,
+# de node_keys), así que al cambiar una regla, el archivo de fusiones o el
+# código del nodo se recalcula en la siguiente ejecución sin reiniciar la app.
+DENUE_CTX = {'denue': DENUE_PATH}
+
+@st.cache_resource()
+def get_cube(keys, csv_hash):
+    return materialize('cubo', DENUE_CTX, loaded={'denue': get_denue(csv_hash)})
+
+# Los mismos datos con todas las reglas de COLONIA_RULES aplicadas (ver cleaning.py)
+DENUE_CLEAN = ['hoteles_limpios', 'cubo_limpio', 'reporte_limpieza']
+
+@st.cache_resource()
+def get_denue_clean(keys, csv_hash):
+    return materialize_all(DENUE_CLEAN, DENUE_CTX, loaded={'denue': get_denue(csv_hash)})
+
+with section('DENUE: carga'):
+    denue_version = file_hash(DENUE_PATH)
+    pd_hoteles = shared_view(get_denue(denue_version))
+    cube = shared_view(get_cube(node_keys(['cubo'], DENUE_CTX), denue_version))
+    denue_preview = get_denue_preview(denue_version)
 #pd_hoteles = pd_hoteles.rename(columns={'municipio':'nomgeo'})
-st.write(pd_hoteles.head(10))
+st.write(denue_preview)
 
 #st.write(type(hoteles.columns))
 with st.echo(code_location='above'):
     st.write(f"""
-        En total son {len(pd_hoteles.columns)}. De ellas pueden ser interesantes el nombre del establecimiento, 
+        En total son {len(denue_preview.columns)}. De ellas pueden ser interesantes el nombre del establecimiento, 
         la colonia y la alcaldía en donde está, el tipo de actividad, longitud y latitud.
 
         Vamos a generar otro _dataframe_ seleccionando solamente esas columnas.
@@ -83,25 +159,100 @@ with st.echo(code_location='above'):
     ___
     ##### Valores únicos de tres columnas del _dataset_ *hoteles*
 
+    Los valores únicos (y cuántos establecimientos tiene cada uno) salen del cubo de conteos; las
+    tablas están paginadas (`paged_table` en utils.py): solamente se manda al navegador la página visible.
+
      - **Nombre de la actividad (*nombre_act*)**
 '''
 
-st.write(hoteles.nombre_act.sort_values().unique())
+paged_table(rollup(cube, ['nombre_act']), 'valores_actividad', denue_version, sort=('nombre_act', True))
 
 '''
          - **Nombre de la colonia (*nomb_asent*)**
 '''
 
-st.write(hoteles.nomb_asent.sort_values().unique())
+colonias = rollup(cube, ['nomb_asent'])
+paged_table(colonias, 'valores_colonia', denue_version, sort=('nomb_asent', True))
 
 st.write(f"""
-    Tenemos un total de {len(hoteles.nomb_asent.sort_values().unique())} colonias.
+    Tenemos un total de {len(colonias)} colonias.
 """)
 
 '''
          - **Nombre de las alcaldías (*alcaldia*)**
 '''
-st.write(hoteles.alcaldia.sort_values().unique())
+paged_table(rollup(cube, ['alcaldia']), 'valores_alcaldia', denue_version, sort=('alcaldia', True))
+
+##
+# Explorador por alcaldía y actividad
+##
+# Los renglones del DENUE se ordenan una sola vez por alcaldía y actividad
+# (group_index, aggregates.py), así que filtrar es tomar un slice y no recorrer
+# toda la tabla. Con st.fragment, al cambiar la selección solamente se vuelve
+# a ejecutar esta sección y no todo el script.
+@st.cache_resource()
+def get_denue_groups(csv_hash):
+    return group_index(get_denue(csv_hash).rename(columns={'municipio': 'alcaldia'}), ['alcaldia', 'nombre_act'])
+
+TODAS = 'Todas'
+
+@st.fragment
+def explore_denue():
+    denue_orden, grupos = get_denue_groups(denue_version)
+    col_a, col_b = st.columns(2)
+    alcaldia = col_a.selectbox('Alcaldía', [TODAS] + list(pd.unique(grupos['alcaldia'])), key='denue_alcaldia')
+    actividades = grupos if alcaldia == TODAS else grupos[grupos['alcaldia'] == alcaldia]
+    actividad = col_b.selectbox('Actividad', [TODAS] + sorted(pd.unique(actividades['nombre_act'])),
+                                key='denue_actividad')
+    seleccion = select_rows(denue_orden, grupos,
+                            alcaldia=None if alcaldia == TODAS else alcaldia,
+                            nombre_act=None if actividad == TODAS else actividad)
+    st.write(f'{len(seleccion):,} establecimientos')
+    paged_table(seleccion[['nom_estab', 'nombre_act', 'nomb_asent', 'alcaldia']], 'denue_seleccion',
+                (denue_version, alcaldia, actividad))
+
+'''
+    ___
+    ##### Alojamientos por alcaldía y actividad
+'''
+explore_denue()
+
+##
+# Alcaldía según las coordenadas
+##
+# La alcaldía del DENUE (municipio) es texto; con las coordenadas se busca el
+# polígono de la alcaldía que contiene a cada establecimiento en el archivo
+# local de límites (spatial.py) y se marcan los que no coinciden. La asignación
+# se guarda junto al CSV; geopandas se importa solamente si hay límites.
+@st.cache_resource()
+def get_denue_spatial(csv_hash, boundaries_hash):
+    from spatial import join_denue
+    return join_denue(DENUE_PATH, BOUNDARIES_PATH)
+
+def show_spatial_check(df, declared, joined, key, version):
+    from spatial import mismatch_report
+    fuera = int(joined['alcaldia_geo'].isna().sum())
+    distintos = int((joined['coincide'] == False).sum())
+    st.write(f"""
+        De {len(joined):,} renglones, **{distintos:,}** declaran una alcaldía distinta a la de sus coordenadas
+        y {fuera:,} quedan fuera de todos los polígonos.
+    """)
+    paged_table(mismatch_report(df[declared], joined), key, version, sort=('renglones', False))
+
+'''
+    ___
+    ##### Alcaldía declarada y alcaldía según las coordenadas
+'''
+if os.path.exists(BOUNDARIES_PATH):
+    with section('DENUE: alcaldía por coordenadas'):
+        boundaries_version = file_hash(BOUNDARIES_PATH)
+        denue_geo = shared_view(get_denue_spatial(denue_version, boundaries_version))
+        show_spatial_check(pd_hoteles, 'municipio', denue_geo, 'denue_geo', (denue_version, boundaries_version))
+else:
+    st.info(f"""
+        Para comparar la alcaldía declarada con la de las coordenadas hace falta el archivo de límites
+        de las alcaldías ({BOUNDARIES_PATH}, ver README.md).
+    """)
 
 '''
     ___
@@ -109,6 +260,7 @@ st.write(hoteles.alcaldia.sort_values().unique())
 ##
 # Gráficos por _features_
 ##
+mark('DENUE: gráficos')
 
 '''
     #### Gráfico de barras de tipo de actividad de los alojamientos temporales por alcaldía
@@ -124,19 +276,21 @@ st.write(hoteles.alcaldia.sort_values().unique())
 '''
 with st.echo(code_location='above'):
 
-    # Agrupamos por actividad y alcaldía, creamos el campo de count
-    df_hna_count_a= hoteles[['nomb_asent', 'alcaldia']].groupby(['nomb_asent', 'alcaldia']).size().reset_index(name='count')
+    # Agrupamos por colonia y alcaldía a partir del cubo, creamos el campo de count
+    df_hna_count_a= rollup(cube, ['nomb_asent', 'alcaldia'])
     
     # Ocultamos el despliegue de los df
     with st.expander("Visualizar/Ocultar dataframe de alojamientos.", expanded=False):
         '''
             **Cantidad de alojamientos por colonia y alcaldía**
         '''
-        st.write(df_hna_count_a.sort_values(by=['count'], ascending=False))
+        paged_table(df_hna_count_a, 'conteo_colonia', denue_version, sort=('count', False))
 
     # Gráfico de barras
 
-    fig_a = px.bar(df_hna_count_a.sort_values(by=['count'], ascending = False).head(20), x="nomb_asent", y='count',
+    # px_figure (utils.py) aplica el tema del proyecto y memoriza la figura;
+    # compact=True dibuja las barras con una sola traza (ver compact_bar)
+    fig_a = px_figure('bar', top_n(df_hna_count_a, 20), compact=True, x="nomb_asent", y='count',
             title = "Alojamientos temporales en la CDMX por Colonia.<br>Se muestran solamente los 20 primeros.", 
             color="nomb_asent", 
             labels={ # Replaces default labels by column name
@@ -146,21 +300,6 @@ with st.echo(code_location='above'):
             width = 800, 
             height = 800
     )
-    
-    BGCOLOR = "#A9BCF5"
-    
-    fig_a.update_layout({
-        #'yaxis_title': 'Cantidad',
-        #'xaxis_title': 'Colonia',
-        'plot_bgcolor': BGCOLOR,
-        'paper_bgcolor': BGCOLOR,
-        'font_family':"Cantarell",
-        'font_size': 14,
-        'font_color' :"#0B2161",
-        'title_font_family':"Cantarell",
-        'title_font_color':"black",
-        'legend_title_font_color':"black"    
-    })
 
 fig_a
 
@@ -174,21 +313,20 @@ fig_a
 # Gráfico de barras 
 with st.echo(code_location='above'):
 
-    # Nuevo campo para concatenar la colonia con la alcaldía, la usaremos en un momento
-    hoteles['col_alc']=hoteles['nomb_asent'].astype(str)+'/'+hoteles['alcaldia']
-
-    # Agrupamos por actividad y alcaldía, creamos el campo de count
-    df_hna_count_b= hoteles[['col_alc', 'alcaldia']].groupby(['col_alc', 'alcaldia']).size().reset_index(name='count')
+    # Agrupamos por colonia y alcaldía y concatenamos ambas en un nuevo campo.
+    # La concatenación se hace sobre el agrupado, no renglón por renglón.
+    df_hna_count_b= rollup(cube, ['nomb_asent', 'alcaldia'])
+    df_hna_count_b.insert(0, 'col_alc', df_hna_count_b.pop('nomb_asent')+'/'+df_hna_count_b['alcaldia'])
     
     # Ocultamos el despliegue de los df
     with st.expander("Visualizar/Ocultar dataframe de alojamientos.", expanded=False):
         '''
             **Cantidad de alojamientos por colonia y alcaldía**
         '''
-        st.write(df_hna_count_b.sort_values(by=['count'], ascending=False))
+        paged_table(df_hna_count_b, 'conteo_colonia_alcaldia', denue_version, sort=('count', False))
         #st.write(df_hna_count.sort_values(by=['count'], ascending=False))
 
-    fig_b = px.bar(df_hna_count_b.sort_values(by=['count'], ascending = False).head(20), x="col_alc", y='count',
+    fig_b = px_figure('bar', top_n(df_hna_count_b, 20), compact=True, x="col_alc", y='count',
             title = "Alojamientos temporales en la CDMX por Colonia.<br>Se muestran solamente los 20 primeros.", 
             color="col_alc", 
             labels={ 
@@ -198,25 +336,13 @@ with st.echo(code_location='above'):
             width = 800, 
             height = 850
     )
-    
-BGCOLOR = "#A9BCF5"
-
-fig_b.update_layout({
-    'plot_bgcolor': BGCOLOR,
-    'paper_bgcolor': BGCOLOR,
-    'font_family':"Cantarell",
-    'font_size': 14,
-    'font_color' :"#0B2161",
-    'title_font_family':"Cantarell",
-    'title_font_color':"black",
-    'legend_title_font_color':"black"    
-})
 
 fig_b
 
 ##
 # Limpieza de datos
 ##
+mark('DENUE: limpieza')
 
 '''
     #### Limpieza de datos
@@ -247,11 +373,13 @@ El cambio debemos hacerlo en el _dataset_ *hoteles*, antes de hacer el _groupby_
 Procedamos.
 """)
 with st.echo(code_location='above'):
-    #Hacemos el cambio en el _dataset_ *hoteles*
-    hoteles['nomb_asent'] = hoteles.nomb_asent.replace("CENTR0", "CENTRO")
+    #Hacemos el cambio en el _dataset_ *hoteles* y en las etiquetas del cubo.
+    #La regla 'centr0' está declarada en COLONIA_RULES (cleaning.py)
+    hoteles['nomb_asent'], reporte = normalize_categories(hoteles.nomb_asent, ['centr0'])
+    cube = relabel(cube, 'nomb_asent', lambda s: apply_rules(s, ['centr0']))
 
     #Recreamos el agrupado
-    df_hna_count_a= hoteles[['nomb_asent', 'alcaldia']].groupby(['nomb_asent', 'alcaldia']).size().reset_index(name='count')
+    df_hna_count_a= rollup(cube, ['nomb_asent', 'alcaldia'])
 
     #Mostramos el resultado
     st.write(df_hna_count_a[df_hna_count_a.nomb_asent.str.contains('^CENTR')])
@@ -269,11 +397,13 @@ with st.echo(code_location='above'):
 """
 
 with st.echo(code_location='above'):
-    #Hacemos el cambio en el _dataset_ *hoteles*
-    hoteles = hoteles.replace({'nomb_asent': r'^CENTRO.*$'}, {'nomb_asent': 'CENTRO'}, regex=True)
+    #Hacemos el cambio en el _dataset_ *hoteles* y en las etiquetas del cubo.
+    #La regla 'centro' sustituye r'^CENTRO.*$' por 'CENTRO'
+    hoteles['nomb_asent'], reporte = normalize_categories(hoteles.nomb_asent, ['centro'])
+    cube = relabel(cube, 'nomb_asent', lambda s: apply_rules(s, ['centro']))
 
     # Recreamos el agrupado
-    df_hna_count_a= hoteles[['nomb_asent', 'alcaldia']].groupby(['nomb_asent', 'alcaldia']).size().reset_index(name='count')
+    df_hna_count_a= rollup(cube, ['nomb_asent', 'alcaldia'])
 
     # Mostramos lo obtenido
     st.write(df_hna_count_a[df_hna_count_a.nomb_asent.str.contains('^CENTR')].head(20))
@@ -282,9 +412,31 @@ with st.echo(code_location='above'):
     Note que ya recuperamos todas las colonias (**116**) que contienen la palabra «CENTRO», en particular 
     las de la alcaldía Cuahtémoc.
 
+    **- Normalización de espacios, mayúsculas y acentos**
+
+    Hay colonias que aparecen escritas con y sin acentos, por ejemplo «JUAREZ» y «JUÁREZ». 
+    Falta aplicar el resto de las reglas de COLONIA_RULES. En lugar de seguir regla por regla, 
+    tomamos los datos ya limpios con todas las reglas de COLONIA_RULES (las dos anteriores, las de 
+    espacios, mayúsculas y acentos y las que se agreguen): son los nodos `hoteles_limpios` y 
+    `cubo_limpio` de pipeline.py, que se recalculan solamente cuando cambian las reglas o los datos. 
+    La tabla muestra cuántas colonias distintas y cuántos renglones modificó cada regla.
+
+    La regla «similares» aplica las fusiones de colonias con nombres casi iguales (p. ej. «CUAHUTEMOC» 
+    y «CUAUHTEMOC») que se hayan aprobado en el archivo que genera `python cleaning.py suggest`, cada una 
+    solamente en su alcaldía. Las fusiones que se aprueben con la app corriendo se aplican al volver a 
+    ejecutar la página.
+"""
+
+with st.echo(code_location='above'):
+    hoteles, cube, reporte = get_denue_clean(node_keys(DENUE_CLEAN, DENUE_CTX), denue_version)
+    df_hna_count_a= rollup(cube, ['nomb_asent', 'alcaldia'])
+
+    st.write(reporte)
+
+"""
     Ya estamos listos para construir el nuevo gráfico.
 """
-fig_c = px.bar(df_hna_count_a.sort_values(by=['count'], ascending = False).head(20), x="nomb_asent", y='count',
+fig_c = px_figure('bar', top_n(df_hna_count_a, 20), compact=True, x="nomb_asent", y='count',
             title = "Alojamientos temporales en la CDMX por Colonia.<br>Se muestran solamente los 20 primeros.", 
             color="nomb_asent", 
             labels={ 
@@ -294,19 +446,6 @@ fig_c = px.bar(df_hna_count_a.sort_values(by=['count'], ascending = False).head(
             width = 800, 
             height = 750
     )
-    
-BGCOLOR = "#A9BCF5"
-
-fig_c.update_layout({
-    'plot_bgcolor': BGCOLOR,
-    'paper_bgcolor': BGCOLOR,
-    'font_family':"Cantarell",
-    'font_size': 14,
-    'font_color' :"#0B2161",
-    'title_font_family':"Cantarell",
-    'title_font_color':"black",
-    'legend_title_font_color':"black"    
-})
 
 fig_c
 
@@ -317,10 +456,10 @@ fig_c
 '''
 # Gráfico de barras con varias facetas
 with st.echo(code_location='above'):
-    # Agrupamos por actividad y alcaldía, creamos el campo de count
-    df_hna_count= hoteles[['nombre_act','alcaldia']].groupby(['alcaldia','nombre_act']).size().reset_index(name='count')
+    # Agrupamos por actividad y alcaldía a partir del cubo limpio, creamos el campo de count
+    df_hna_count= rollup(cube, ['alcaldia', 'nombre_act'])
 
-    fig = px.bar(df_hna_count, x="alcaldia", y='count',
+    fig = px_figure('bar', df_hna_count, compact=True, x="alcaldia", y='count',
             title = "Actividad de los alojamientos temporales en la CDMX", facet_col = 'nombre_act',
             facet_col_wrap= 2,
             color="alcaldia",
@@ -332,19 +471,6 @@ with st.echo(code_location='above'):
             width = 1000, 
             height = 1000
     )
-    
-    BGCOLOR = "#A9BCF5"
-    
-    fig.update_layout({
-        'plot_bgcolor': BGCOLOR,
-        'paper_bgcolor': BGCOLOR,
-        'font_family':"Cantarell",
-        'font_size': 14,
-        'font_color' :"#0B2161",
-        'title_font_family':"Cantarell",
-        'title_font_color':"black",
-        'legend_title_font_color':"black"    
-    })
 
 fig
 
@@ -362,24 +488,42 @@ st.error('Incluir comentarios (insights)')
 # Análisis de tipos de actividades por alcaldía, usando gráficos de barras con facetas.
 ##
 
-url = "http://data.insideairbnb.com/mexico/df/mexico-city/2021-12-25/visualisations/listings.csv"
-#@st.cache_data(allow_output_mutation=True)
-@st.cache_data()
-def get_data():
-    return pd.read_csv(url)
-
-df_abb = get_data()
+##
+# Esperamos la carga anticipada de los listings (ver el inicio del script)
+##
+mark('AirBnB: carga')
+with section('AirBnB: espera de la carga anticipada'):
+    df_abb, abb_loaded = wait_listings(abb_future, abb_snapshot, timeout=ABB_TIMEOUT)
+    # El dataframe del Future es el mismo para todas las sesiones
+    df_abb = shared_view(df_abb)
+# Los listings tal como se cargaron; los nodos de pipeline.py los usan en lugar
+# de volver a leer el snapshot
+abb_listings = df_abb
+# Los derivados de los listings se guardan por versión (hash) del snapshot
+abb_manifest = read_manifest(abb_loaded)
+abb_version = abb_manifest and abb_manifest['sha256']
+if abb_loaded != abb_snapshot:
+    st.warning(f"No fue posible cargar el snapshot {abb_snapshot}, se usa la copia local {abb_loaded}.")
 
 st.write(df_abb.head(5))
+
+# Como en el DENUE, la alcaldía de cada listing (neighbourhood) se compara con la
+# de sus coordenadas; la asignación se guarda junto al snapshot
+@st.cache_resource()
+def get_listings_spatial(snapshot, version, boundaries_hash, _df):
+    from spatial import join_listings
+    return join_listings(snapshot, _df, BOUNDARIES_PATH)
+
+if os.path.exists(BOUNDARIES_PATH):
+    with section('AirBnB: alcaldía por coordenadas'):
+        abb_geo = shared_view(get_listings_spatial(abb_loaded, abb_version, boundaries_version, df_abb))
+        show_spatial_check(df_abb, 'neighbourhood', abb_geo, 'abb_geo', (abb_version, boundaries_version))
 ##
 # Limpieza de datos (RAF).
 ##
-# ???
-# df_abb['price'] = df_abb['price'].replace(regex=['^.'],value='')
-# # Quitamos las comas
-# df_abb['price'] = df_abb['price'].replace(regex=[','],value='')
-# # Lo hacemos flotante
-# df_abb["price"] = pd.to_numeric(df_abb["price"], downcast="float")
+# En el archivo detallado (listings.csv.gz) los precios vienen como texto
+# ('$1,234.00'); loaders.read_detailed_listings los convierte a números al
+# leer el archivo, junto con los porcentajes (ver DETAILED_COLUMNS).
 
 ##
 # Introducción
@@ -410,19 +554,30 @@ st.markdown("Columnas del *dataset*:")
 st.markdown('<p>' + str_cols + '</p>', unsafe_allow_html=True)
 
 #st.dataframe(df_abb.head(5))
-st.code("""
-import missingno as msno 
-p = msno.matrix(df_abb)
-st.pyplot(p.figure)
-""")
 
 # Análisis de nulos
+mark('AirBnB: nulos')
 """
-### Análisis de nulos usando missingno
+### Análisis de nulos
+
+En lugar de dibujar cada renglón, agrupamos los renglones en bloques consecutivos y 
+calculamos la proporción de nulos de cada columna en cada bloque. El perfil se guarda 
+junto al _snapshot_, así que se calcula una sola vez por versión de los datos.
 """
-import missingno as msno 
-p = msno.matrix(df_abb)
-st.pyplot(p.figure)
+@st.cache_data()
+def get_null_profile(keys, snapshot, _listings):
+    return materialize('nulos', {'snapshot': snapshot}, loaded={'listings': _listings})
+
+with st.echo(code_location='above'):
+    perfil = get_null_profile(node_keys(['nulos'], {'snapshot': abb_loaded}), abb_loaded, abb_listings)
+    st.write(null_counts(perfil))
+
+    fig_nulos = px_figure('imshow', null_density(perfil), zmin=0, zmax=1, aspect='auto',
+            color_continuous_scale='gray_r',
+            labels={'x': 'Columna', 'y': 'Bloque de renglones', 'color': 'Nulos'},
+            title='Proporción de nulos por bloque de renglones',
+            height=600)
+fig_nulos
 # Limpieza del dataset
 st.markdown("Eliminamos algunas columnas que no son útiles para aligerar el análisis: `id`, `host_id` y `neighbourhood_group` y otras más.")
 
@@ -443,6 +598,7 @@ st.markdown('<p>' + str_cols + '</p>', unsafe_allow_html=True)
 st.markdown("Los primeros cinco registros del *dataset* son:")
 st.dataframe(df_abb.head(5))
 
+mark('AirBnB: estadística')
 st.markdown('## Análisis estadístico')
 st.markdown("""
 Haremos un somero análisis estadístico del *dataset* con la función _describe()_ de Python. 
@@ -450,28 +606,66 @@ Haremos un somero análisis estadístico del *dataset* con la función _describe
 La función _describe()_ se utiliza para calcular algunos datos estadísticos como percentiles, media y desviacion 
 estándar de los valores numéricos de nuestros datos.
 """)
-# calling describe method
-desc = df_abb.describe()
+##
+# Resúmenes por alcaldía
+##
+# Conteos, media, varianza, mínimo, máximo y cuantiles de cada columna numérica
+# se calculan una sola vez por alcaldía y versión del snapshot (nodos
+# resumen_* de pipeline.py). De ellos salen describe(), los KPI, las tablas por alcaldía y los
+# box plots, sin volver a recorrer los renglones (ver summaries.py).
+@st.cache_resource()
+def get_summary(keys, snapshot, name, _listings, method=None):
+    ctx = {'snapshot': snapshot} if method is None else {'snapshot': snapshot, 'metodo': method}
+    return tuple(materialize_all([f'{name}_momentos', f'{name}_sketch'], ctx, loaded={'listings': _listings}))
+
+def summary_keys(name, method=None):
+    ctx = {'snapshot': abb_loaded} if method is None else {'snapshot': abb_loaded, 'metodo': method}
+    return node_keys([f'{name}_momentos', f'{name}_sketch'], ctx)
+
+# calling describe method (los percentiles son aproximados)
+resumen = get_summary(summary_keys('resumen'), abb_loaded, 'resumen', abb_listings)
+desc = describe_summary(resumen)
 # display
 st.dataframe(desc)
 
 st.markdown(f"""
-    Podemos observar que el precio promedio de los _listings_ es de \$**{np.trunc(df_abb.price.mean())}**, y 
-    que el precio máximo es de \$**{np.trunc(df_abb.price.max())}**. Probablemente es un error, pero si dejamos ese 
+    Podemos observar que el precio promedio de los _listings_ es de \$**{np.trunc(desc.loc['mean', 'price'])}**, y 
+    que el precio máximo es de \$**{np.trunc(desc.loc['max', 'price'])}**. Probablemente es un error, pero si dejamos ese 
     valor nuestros cálculos se verán afectados por ser un _outlier_.
 """)
 
 # Eliminamos outliers
-MAX = 20000
+METODO = 'iqr'
 st.markdown(f"""
-    Después de eliminar los valores atípicos (*outliers*), en nuestro caso  valores mayores a ${MAX} volvemos a _describir_ nuestros datos.
+    Después de eliminar los valores atípicos (*outliers*) volvemos a _describir_ nuestros datos. En lugar de un solo 
+    límite para toda la ciudad, los límites del precio se calculan para cada alcaldía con el método `{METODO}` 
+    (ver `OUTLIER_METHODS` en outliers.py), así que no se eliminan los precios altos de las alcaldías caras ni se 
+    conservan los atípicos de las baratas.
     (_Un valor atípico es una observación que se encuentra a una distancia anormal de otros valores en una muestra aleatoria de una población. En cierto sentido, esta definición deja en manos del analista (o de un proceso de consenso) decidir qué se considerará anormal. Antes de poder distinguir las observaciones anormales, es necesario caracterizar las observaciones normales_.)
 """)
 
+# Los límites y los listings sin outliers se calculan una vez por versión del
+# snapshot y método (nodos limites_precio y listings_limpios de pipeline.py) y
+# se leen una vez por proceso; cada sesión recibe una vista del resultado
+LISTINGS_CLEAN = ['listings_limpios', 'reporte_outliers']
+
+@st.cache_resource()
+def get_listings_clean(keys, snapshot, method, _listings):
+    return tuple(materialize_all(LISTINGS_CLEAN, {'snapshot': snapshot, 'metodo': method},
+                                 loaded={'listings': _listings}))
+
+# Las tablas y selecciones que salen de los listings limpios usan estas llaves como versión
+abb_ctx = {'snapshot': abb_loaded, 'metodo': METODO}
+limpios_keys = node_keys(LISTINGS_CLEAN, abb_ctx)
+resumen_limpio_keys = summary_keys('resumen_limpio', METODO)
+
 with st.echo(code_location='above'):
-    MAX = 20000
-    df_abb = df_abb[df_abb['price'] <= MAX]
-    st.write(df_abb.describe())
+    df_abb, reporte_outliers = get_listings_clean(limpios_keys, abb_loaded, METODO, abb_listings)
+    df_abb = shared_view(df_abb)
+    st.write(reporte_outliers)
+    resumen = get_summary(resumen_limpio_keys, abb_loaded, 'resumen_limpio', abb_listings, METODO)
+    desc = describe_summary(resumen)
+    st.write(desc)
 
 """
     Observemos que los valores de media y valore máximo para el precio(_price_) ha disminuido al 
@@ -484,6 +678,7 @@ with st.echo(code_location='above'):
 # KPI con go para describe
 ##
 
+mark('AirBnB: dashboard')
 st.title("Dashboard para toda la CDMX")
 
 st.markdown('#### ¿Que es un tablero (*dashboard*)')
@@ -496,13 +691,16 @@ lo que le permite elegir qué datos desea ver y si desea incluir tablas o gráfi
 
 # st.markdown('## Algunos valores')
 # st.write(df_abb['price'].iloc[0])
+# Los KPI salen del resumen de los datos sin outliers
+por_alcaldia = group_stats(resumen, 'price')
+
 # Máximo de precios
-max_price = df_abb['price'].max()
+max_price = desc.loc['max', 'price']
 # #max_price = "{:,}".format(max_price)
 # st.write(max_price)
 
 #Cantidad de registros
-qrows_0= df_abb.shape[0]
+qrows_0= int(por_alcaldia['renglones'].sum())
 qrows = "{:,}".format(qrows_0)
 
 font_color_text = '#7FB3D5'
@@ -511,19 +709,17 @@ BGCOLOR = "#042f47"
 
 
 # Precio promedio
-price_avg_0 = df_abb['price'].mean()
+price_avg_0 = desc.loc['mean', 'price']
 price_avg = f"{price_avg_0:,.2f}"
 
 # Cantidad promedio de reviews
-rev_avg_0 = df_abb['number_of_reviews'].mean()
+rev_avg_0 = desc.loc['mean', 'number_of_reviews']
 rev_avg = f"{rev_avg_0:,.2f}"
-col01, col02, col03 = st.columns(3)
-#col1 = st.columns(3)
 
-fig_ind = go.Figure()
+def build_fig_ind():
+    import plotly.graph_objects as go
+    fig_ind = go.Figure()
 
-with col01:
-    ref = 5
     fig_ind.add_trace(go.Indicator(
         mode = "number",
         number = {'prefix': "$",'font.size' : 55, 'font.color': font_color_number, 'valueformat':','},
@@ -531,7 +727,6 @@ with col01:
         title = {'text': 'Precio<br>Máximo', 'font.size': 25, 'font.color':font_color_text},
         domain = {'row': 0, 'column': 0}))
 
-with col02:
     fig_ind.add_trace(go.Indicator(
         mode = "number",
         number = {'prefix': "$", 'font.size' : 55, 'font.color': font_color_number},
@@ -539,8 +734,6 @@ with col02:
         title = {'text':'Precios<br>Promedio (MX)', 'font.size': 25, 'font.color':font_color_text},
         domain = {'row': 0, 'column': 1}))
 
-with col03:
-    ref = 5
     fig_ind.add_trace(go.Indicator(
         mode = "number",
         number = {'font.size' : 55, 'font.color': font_color_number},
@@ -549,13 +742,17 @@ with col03:
         domain = {'row': 0, 'column': 2})
     )
 
-fig_ind.update_layout(
-    paper_bgcolor = BGCOLOR, 
-    width=1050,
-    height = 250,
-    margin=dict(l=20, r=20, t=40, b=5),
-    grid = {'rows': 1, 'columns': 3, 'pattern': "independent"},
-)
+    fig_ind.update_layout(
+        paper_bgcolor = BGCOLOR, 
+        width=1050,
+        height = 250,
+        margin=dict(l=20, r=20, t=40, b=5),
+        grid = {'rows': 1, 'columns': 3, 'pattern': "independent"},
+    )
+    return fig_ind
+
+# Solamente se reconstruye si cambian los valores
+fig_ind = memo_figure(build_fig_ind, 'fig_ind', max_price, price_avg_0, rev_avg_0)
 
 ##
 # Mostramos los KPI
@@ -573,14 +770,10 @@ st.markdown("""
     ### Listado de alcaldías y _listings_, ordenados por cantidad de _listings_. 
 """)
 
-a_array = df_abb.groupby(['neighbourhood'])['neighbourhood'].count()
-#st.write(a_array)
-df_a = a_array.to_frame()
-df_a = df_a.rename(columns={'neighbourhood': 'Cant. Listings'}) 
-df_a.reset_index(inplace=True)
+df_a = por_alcaldia[['neighbourhood', 'renglones']].rename(columns={'renglones': 'Cant. Listings'})
 
 # Mostramos del df
-st.write(df_a.sort_values(by=['Cant. Listings']))
+paged_table(df_a, 'listings_alcaldia', resumen_limpio_keys, sort=('Cant. Listings', True))
 
 st.markdown('### Revelaciones (*insights*)')
 #str_01 = '<p style="font-family:sans-serif; color:Green; font-size: 42px;">Observe que en Milpa alta solo existen 19 _listings_.</p>'
@@ -594,20 +787,16 @@ ama_max_listings = df_a['Cant. Listings'].max()
 ama_avg_listings = df_a['Cant. Listings'].mean()
 ama_min_listings = df_a['Cant. Listings'].min()
 
-col_ama01, col_ama02, col_ama03 = st.columns(3)
-
 st.markdown("## Datos sobre cantidades de _listings_ por alcaldía")
 
 ##
 # Caso Milpa Alta
 ##
 #Análisis de min, max, mean de listings
-fig_agl = go.Figure()
+def build_fig_agl():
+    import plotly.graph_objects as go
+    fig_agl = go.Figure()
 
-# Análisis de precios de listings Milpa Alta
-fig_aama = go.Figure()
-
-with col_ama01:
     str1 = """Cantidad <br>
     <span style='color:#d38c27'>Máxima de </span><i>listings</i><br><span style='color:white'>      (Cuauhtémoc)</span>
     """
@@ -619,7 +808,6 @@ with col_ama01:
         title = {'text': str1, 'font.size': 18, 'font.color':font_color_text},
         domain = {'row': 0, 'column': 0}))
 
-with col_ama02:
     str2 = """Cantidad <br>
     <span style='color:#d38c27'>Promedio </span><i>de listings</i>
     """
@@ -631,7 +819,6 @@ with col_ama02:
         title = {'text': str2, 'font.size': 18, 'font.color':font_color_text},
         domain = {'row': 0, 'column': 1}))
 
-with col_ama03:
     str3 = """Cantidad <br>
     <span style='color:#d38c27'>Mínima </span><i>de listings</i><br><span style='color:white'>    (Milpa Alta)</span>
     """
@@ -643,13 +830,17 @@ with col_ama03:
         title = {'text': str3, 'font.size': 18, 'font.color':font_color_text},
         domain = {'row': 0, 'column': 2}))
 
-fig_agl.update_layout(
-    paper_bgcolor = "#042f47", 
-    width=1050,
-    height = 300,
-    margin=dict(l=20, r=20, t=20, b=20),
-    grid = {'rows': 1, 'columns': 3, 'pattern': "independent"},
-)
+    fig_agl.update_layout(
+        paper_bgcolor = "#042f47", 
+        width=1050,
+        height = 300,
+        margin=dict(l=20, r=20, t=20, b=20),
+        grid = {'rows': 1, 'columns': 3, 'pattern': "independent"},
+    )
+    return fig_agl
+
+# Solamente se reconstruye si cambian los valores
+fig_agl = memo_figure(build_fig_agl, 'fig_agl', int(ama_max_listings), int(ama_avg_listings), int(ama_min_listings))
 
 # Mostramos las tres columnas
 fig_agl
@@ -667,26 +858,21 @@ st.info("""
     se encuentre el mayor precio promedio de la CDMX?
 """)
 
+# Paleta de plotly express (se importa hasta esta sección)
+import plotly.express as px
+
 col11, col12 = st.columns(2)
 
 with col11:
-    fig1 = px.bar(df_a, x='neighbourhood', y='Cant. Listings', 
+    fig1 = px_figure('bar', df_a, x='neighbourhood', y='Cant. Listings', 
     color = 'neighbourhood',
-    title = 'Cantidad de Listings por Alcaldía de la CDMX')
-    fig1.update_layout(width=600,height=600)
-    fig1.update_yaxes(title_text='Cantidad de Listings')
-    fig1.update_xaxes(title_text='Alcaldías')
-    fig1.update_layout({
-        #'plot_bgcolor': 'red',
-        'paper_bgcolor': BGCOLOR,
-    })
+    title = 'Cantidad de Listings por Alcaldía de la CDMX',
+    theme = DASHBOARD_THEME,
+    layout = {'width': 600, 'height': 600, 'yaxis_title': 'Cantidad de Listings', 'xaxis_title': 'Alcaldías'})
     st.plotly_chart(fig1, use_container_width=True)
 
 # Promedio de precios por alcaldía
-ap_array = df_abb.groupby(['neighbourhood'])['price'].mean()
-
-df_ap = ap_array.to_frame()
-df_ap.reset_index(inplace=True)
+df_ap = por_alcaldia[['neighbourhood', 'mean']].rename(columns={'mean': 'price'})
 
 df_ap = df_ap.sort_values(by=['price'], ascending = False)
 
@@ -700,17 +886,12 @@ with col12:
     # })
     # st.plotly_chart(fig1, use_container_width=True)
 
-    fig1 = px.bar(df_ap, x='neighbourhood', y='price', 
+    fig1 = px_figure('bar', df_ap, x='neighbourhood', y='price', 
     color_discrete_sequence=px.colors.qualitative.Pastel, 
     color='price', 
-    title = 'Precios Promedio por Alcaldía')
-    fig1.update_layout(width=600,height=600)
-    fig1.update_yaxes(title_text='Precio Promedio')
-    fig1.update_xaxes(title_text='Alcaldías')
-    fig1.update_layout({
-        #'plot_bgcolor': 'red',
-        'paper_bgcolor': BGCOLOR,
-    })
+    title = 'Precios Promedio por Alcaldía',
+    theme = DASHBOARD_THEME,
+    layout = {'width': 600, 'height': 600, 'yaxis_title': 'Precio Promedio', 'xaxis_title': 'Alcaldías'})
     
     st.plotly_chart(fig1, use_container_width=True)
 
@@ -718,24 +899,152 @@ with col12:
     ___
 """
 
-#Box_plot para precios de Milpa Alta
-#df_db = df_abb.drop(['id', 'host_id', 'neighbourhood_group'], axis='columns', inplace=False)
-df_ma = df_abb[df_abb['neighbourhood']=='Milpa Alta']
-fig_bp = px.box(df_ma, y="price", title='Box Plot para los precios de listings en Milpa Alta')
+##
+# Competencia: hoteles del DENUE cerca de los listings
+##
+# Para cada listing, la distancia al hotel más cercano y cuántos hoteles hay a
+# menos de PROXIMITY_RADIUS_M metros, y lo mismo para cada hotel respecto a los
+# listings, con un KD-tree sobre las coordenadas (proximity.py). Los resultados
+# por renglón son los nodos cercania_* de pipeline.py, así que dependen de la
+# versión del snapshot, del método de outliers y de la versión del DENUE.
+# scipy se importa hasta que se calculan (ver proximity.py)
+
+PROXIMITY_NODES = ['cercania_listings', 'cercania_hoteles']
+
+@st.cache_resource()
+def get_proximity(keys, snapshot, method, csv_hash, _listings):
+    return tuple(materialize_all(PROXIMITY_NODES, {'snapshot': snapshot, 'metodo': method, 'denue': DENUE_PATH},
+                                 loaded={'listings': _listings, 'denue': get_denue(csv_hash)}))
+
+st.markdown("### Competencia: hoteles tradicionales y _listings_")
+with section('AirBnB: cercanía con hoteles'):
+    cercania_keys = node_keys(PROXIMITY_NODES, {**abb_ctx, **DENUE_CTX})
+    cerca_listings, cerca_hoteles = get_proximity(cercania_keys, abb_loaded, METODO, denue_version, abb_listings)
+    competencia = competition_kpis(cerca_listings.assign(neighbourhood=df_abb['neighbourhood'].to_numpy()),
+                                   cerca_hoteles.assign(municipio=pd_hoteles['municipio'].to_numpy()))
 
-fig_bp.update_layout(width=600,height=500)
-fig_bp.update_yaxes(title_text='Precio')
-fig_bp.update_xaxes(title_text='Alcaldía Milpa Alta')
+st.markdown(f"""
+    Relacionamos las dos partes del análisis: para cada _listing_ buscamos el hotel del DENUE más cercano y
+    contamos cuántos hay a menos de {PROXIMITY_RADIUS_M} m; para cada hotel, cuántos _listings_ tiene alrededor.
+    En la tabla, por alcaldía, la mediana de esas distancias, los promedios de esos conteos y el porcentaje
+    de _listings_ con al menos un hotel cerca.
+""")
+paged_table(competencia, 'competencia', cercania_keys, sort=('listings', False))
 
-fig_bp.update_layout({
-        #'plot_bgcolor': 'red',
-        'paper_bgcolor': BGCOLOR,
-    })
+fig_comp = px_figure('bar', competencia.sort_values('pct_con_hotel_cerca', ascending=False),
+    x='alcaldia', y='pct_con_hotel_cerca', color='alcaldia',
+    title=f'Porcentaje de listings con un hotel a menos de {PROXIMITY_RADIUS_M} m',
+    theme = DASHBOARD_THEME,
+    layout = {'width': 1000, 'height': 500, 'yaxis_title': '% de listings', 'xaxis_title': 'Alcaldías'})
+st.plotly_chart(fig_comp, width='stretch')
 
-if st.checkbox("Mostrar/Ocultar una de las soluciones"):
-    fig_bp
+"""
+    ___
+"""
+
+#Box_plot para precios de Milpa Alta (o de cualquier alcaldía)
+#df_db = df_abb.drop(['id', 'host_id', 'neighbourhood_group'], axis='columns', inplace=False)
+# El gráfico se construye solamente si se va a mostrar; la caja sale del resumen.
+# Los listings de la alcaldía salen de un slice de los datos ordenados por
+# alcaldía y tipo de habitación (group_index) y, como en el explorador del
+# DENUE, cambiar la selección solamente vuelve a ejecutar esta sección.
+@st.cache_resource()
+def get_listings_groups(keys, _df):
+    return group_index(_df, ['neighbourhood', 'room_type'])
+
+@st.fragment
+def explore_listings():
+    if not st.checkbox("Mostrar/Ocultar una de las soluciones"):
+        return
+    abb_orden, grupos = get_listings_groups(limpios_keys, df_abb)
+    alcaldias = list(df_a['neighbourhood'])
+    col_a, col_b = st.columns(2)
+    alcaldia = col_a.selectbox('Alcaldía', alcaldias,
+        index=alcaldias.index('Milpa Alta') if 'Milpa Alta' in alcaldias else 0)
+    tipos = sorted(pd.unique(grupos.loc[grupos['neighbourhood'] == alcaldia, 'room_type']))
+    tipo = col_b.selectbox('Tipo de habitación', [TODAS] + tipos)
+    fig_bp = px_figure('summary_box', box_stats(resumen, 'price', [alcaldia]), x='neighbourhood',
+        title=f'Box Plot para los precios de listings en {alcaldia}',
+        theme = DASHBOARD_THEME,
+        layout = {'width': 600, 'height': 500, 'yaxis_title': 'Precio', 'xaxis_title': f'Alcaldía {alcaldia}'})
+    st.plotly_chart(fig_bp)
+    seleccion = select_rows(abb_orden, grupos, neighbourhood=alcaldia,
+                            room_type=None if tipo == TODAS else tipo)
+    st.write(f'{len(seleccion):,} listings')
+    paged_table(seleccion, 'listings_seleccion', (limpios_keys, alcaldia, tipo), sort=('price', False))
+
+explore_listings()
 
 """
     En la siguiente parte de este ejercicio usaremos un mapa para continuar investigando que 
     tiene de especial Milpa Alta.
-"""
\ No newline at end of file
+"""
+
+##
+# Mapa por celdas
+##
+# Los puntos se agregan en el servidor en celdas cuadradas (maps.py) y al mapa
+# solamente llegan las celdas, con su conteo, el precio medio o la actividad
+# más frecuente. Cada nivel de la cuadrícula se calcula una vez por versión de
+# los datos (nodos celdas_* de pipeline.py).
+@st.cache_resource()
+def get_listings_grid(keys, snapshot, method, level, _listings):
+    return materialize(f'celdas_listings_{level}', {'snapshot': snapshot, 'metodo': method},
+                       loaded={'listings': _listings})
+
+@st.cache_resource()
+def get_denue_grid(keys, csv_hash, level):
+    return materialize(f'celdas_denue_{level}', DENUE_CTX, loaded={'denue': get_denue(csv_hash)})
+
+NIVELES = {'ciudad': 'Ciudad (2 km)', 'alcaldia': 'Alcaldía (500 m)', 'colonia': 'Colonia (150 m)',
+           'puntos': 'Puntos de la alcaldía'}
+
+@st.fragment
+def show_grid_map():
+    col_d, col_n, col_c = st.columns(3)
+    datos = col_d.radio('Datos', ['Listings de AirBnB', 'Hoteles del DENUE'], key='mapa_datos')
+    nivel = col_n.selectbox('Celdas', list(NIVELES), format_func=NIVELES.get, index=1, key='mapa_nivel')
+    alcaldias = list(centros.index)
+    centro = col_c.selectbox('Centrar en', alcaldias, key='mapa_centro',
+                             index=alcaldias.index('Milpa Alta') if 'Milpa Alta' in alcaldias else 0)
+    if nivel == 'puntos':
+        # Puntos sin agregar, solamente de la alcaldía elegida (un slice de los datos ordenados)
+        if datos == 'Listings de AirBnB':
+            puntos = select_rows(*get_listings_groups(limpios_keys, df_abb), neighbourhood=centro)
+            deck = point_deck(puntos, 'latitude', 'longitude', GRID_ZOOM[nivel], tuple(centros.loc[centro]),
+                              color_by='price', columns=['price', 'room_type'],
+                              tooltip='${price}\n{room_type}')
+        else:
+            puntos = select_rows(*get_denue_groups(denue_version), alcaldia=centro)
+            deck = point_deck(puntos, 'latitud', 'longitud', GRID_ZOOM[nivel], tuple(centros.loc[centro]),
+                              category='nombre_act', columns=['nom_estab', 'nombre_act'],
+                              tooltip='{nom_estab}\n{nombre_act}')
+        st.pydeck_chart(deck)
+        st.caption(f'{len(puntos):,} puntos en {centro}')
+        return
+    if datos == 'Listings de AirBnB':
+        celdas = get_listings_grid(node_keys([f'celdas_listings_{nivel}'], abb_ctx), abb_loaded, METODO, nivel,
+                                   abb_listings).round({'price_media': 0})
+        tooltip = '{count} listings, precio medio ${price_media}\n{room_type} ({room_type_pct}%)'
+        color = 'price_media'
+    else:
+        celdas = get_denue_grid(node_keys([f'celdas_denue_{nivel}'], DENUE_CTX), denue_version, nivel)
+        tooltip = '{count} hoteles\n{nombre_act} ({nombre_act_pct}%)'
+        color = None
+    st.pydeck_chart(grid_deck(celdas, GRID_LEVELS[nivel], GRID_ZOOM[nivel], tuple(centros.loc[centro]),
+                              color_by=color, tooltip=tooltip))
+    st.caption(f'{len(celdas):,} celdas con {int(celdas["count"].sum()):,} puntos')
+
+# Centro de cada alcaldía: la media de las coordenadas de sus listings, del resumen
+centros = pd.DataFrame({
+    'lat': group_stats(resumen, 'latitude').set_index('neighbourhood')['mean'],
+    'lon': group_stats(resumen, 'longitude').set_index('neighbourhood')['mean'],
+})
+st.markdown("### Mapa de _listings_ y hoteles")
+st.markdown("""
+    La altura de cada columna es la cantidad de _listings_ (u hoteles) en la celda y, para los _listings_,
+    el color es el precio medio. Elija el tamaño de las celdas y la alcaldía en la que se centra el mapa.
+""")
+show_grid_map()
+
+profile_report()
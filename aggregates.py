@@ -0,0 +1,187 @@
+##
+# Agregados del DENUE
+##
+# En lugar de repetir un groupby por cada gráfico, contamos una sola vez los
+# establecimientos al nivel más fino (colonia x alcaldía x actividad) y de ese
+# «cubo» sacamos todos los agregados que usa la página.
+##
+import numpy as np
+import pandas as pd
+
+CUBE_DIMS = ['nomb_asent', 'alcaldia', 'nombre_act']
+
+# Tamaño máximo del arreglo denso para contar con np.bincount
+DENSE_LIMIT = 1 << 24
+
+
+def _as_category(s):
+    return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype('category')
+
+
+def count_cube(df, dims=CUBE_DIMS):
+    """Conteo de renglones por combinación de `dims`, en una pasada sobre los
+    códigos categóricos. Como en groupby, se descartan los renglones con nulos.
+    """
+    cats = [_as_category(df[d]) for d in dims]
+    codes = np.stack([c.cat.codes.to_numpy() for c in cats]).astype(np.int64)
+    codes = codes[:, (codes >= 0).all(axis=0)]
+    shape = tuple(max(len(c.cat.categories), 1) for c in cats)
+
+    flat = np.ravel_multi_index(codes, shape)
+    if np.prod(shape, dtype=float) <= DENSE_LIMIT:
+        counts = np.bincount(flat, minlength=int(np.prod(shape)))
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        keys, counts = np.unique(flat, return_counts=True)
+
+    out = pd.DataFrame({
+        d: pd.Categorical.from_codes(i, dtype=c.dtype)
+        for d, i, c in zip(dims, np.unravel_index(keys, shape), cats)
+    })
+    out['count'] = counts
+    return out
+
+
+def _sum_by(cube, dims):
+    return cube.groupby(dims, observed=True, sort=False)['count'].sum().reset_index()
+
+
+def rollup(cube, dims):
+    """Agregado del cubo por `dims`, con las etiquetas como texto."""
+    out = _sum_by(cube, dims)
+    return out.astype({d: str for d in dims})
+
+
+def label_pairs(s, by):
+    """Parejas distintas (etiqueta de `s`, etiqueta de `by`) de dos columnas categóricas.
+
+    Regresa las etiquetas de `s` y de `by` de cada pareja (Series de texto) y la
+    pareja de cada renglón (-1 si `s` es nulo).
+    """
+    codes = s.cat.codes.to_numpy().astype(np.int64)
+    by = by if isinstance(by.dtype, pd.CategoricalDtype) else by.astype('category')
+    by_codes = by.cat.codes.to_numpy().astype(np.int64)
+    k = len(by.cat.categories) + 1
+    valid = codes >= 0
+    pairs, inv = np.unique(codes[valid] * k + by_codes[valid] + 1, return_inverse=True)
+    groups = np.append(np.asarray(by.cat.categories, dtype=object), None)[pairs % k - 1]
+    item = np.full(len(codes), -1, dtype=np.int64)
+    item[valid] = inv
+    return (pd.Series(np.asarray(s.cat.categories, dtype=object)[pairs // k], dtype=str),
+            pd.Series(groups, dtype=str), item)
+
+
+def relabel(cube, dim, func, by=None):
+    """Aplica `func` a las etiquetas (no a los renglones) de `dim` y re-agrega.
+
+    `func` recibe una Serie con las categorías y regresa las etiquetas nuevas;
+    sirve para llevar al cubo las mismas correcciones que se hacen a los datos.
+    Con `by` (otra dimensión, p. ej. 'alcaldia') `func` recibe las parejas
+    distintas de etiquetas: las de `dim` y las de `by`.
+    """
+    if by is None:
+        new_labels = pd.Series(func(pd.Series(cube[dim].cat.categories))).to_numpy()
+        item = cube[dim].cat.codes.to_numpy()
+    else:
+        labels, groups, item = label_pairs(cube[dim], cube[by])
+        new_labels = pd.Series(func(labels, groups)).to_numpy()
+    new_cats = pd.unique(new_labels)
+    remap = pd.Index(new_cats).get_indexer(new_labels)
+    codes = remap[item]
+    cube = cube.assign(**{dim: pd.Categorical.from_codes(codes, categories=new_cats)})
+    return _sum_by(cube, [d for d in cube.columns if d != 'count'])
+
+
+def top_n(frame, n=20, col='count'):
+    """Los `n` renglones con mayor `col`, sin ordenar todo el dataframe."""
+    return frame.nlargest(n, col)
+
+
+##
+# Índice de renglones por grupo
+##
+# Para filtrar por alcaldía (o por actividad) sin recorrer toda la tabla, los
+# renglones se ordenan una sola vez por `dims` y se guarda en dónde empieza y
+# en dónde termina cada combinación. Un filtro es entonces uno o unos cuantos
+# slices del dataframe ordenado y cuesta lo que miden los renglones que regresa.
+def group_index(df, dims):
+    """Ordena `df` por `dims`; regresa el dataframe ordenado y el índice de grupos
+    (columnas `dims`, inicio y fin: el rango [inicio, fin) de cada combinación).
+
+    Los renglones con nulos en `dims` quedan al final y no entran al índice.
+    """
+    cats = [_as_category(df[d]) for d in dims]
+    codes = np.stack([c.cat.codes.to_numpy() for c in cats]).astype(np.int64)
+    shape = tuple(max(len(c.cat.categories), 1) for c in cats)
+    valid = (codes >= 0).all(axis=0)
+    flat = np.where(valid, np.ravel_multi_index(np.maximum(codes, 0), shape), np.prod(shape, dtype=np.int64))
+
+    order = np.argsort(flat, kind='stable')
+    keys, starts, counts = np.unique(flat[order], return_index=True, return_counts=True)
+    inside = keys < np.prod(shape, dtype=np.int64)
+    keys, starts, counts = keys[inside], starts[inside], counts[inside]
+
+    index = pd.DataFrame({
+        d: np.asarray(c.cat.categories)[i].astype(str)
+        for d, i, c in zip(dims, np.unravel_index(keys, shape), cats)
+    })
+    index['inicio'] = starts
+    index['fin'] = starts + counts
+    return df.take(order).reset_index(drop=True), index
+
+
+def select_rows(df, index, **filters):
+    """Renglones de `df` (ordenado con group_index) de los grupos que cumplen `filters`.
+
+    Cada filtro es dimensión=valor o dimensión=[valores]; None no filtra.
+    """
+    mask = np.ones(len(index), dtype=bool)
+    for dim, value in filters.items():
+        if value is not None:
+            values = [value] if isinstance(value, str) else list(value)
+            mask &= index[dim].isin(values).to_numpy()
+    starts = index['inicio'].to_numpy()[mask]
+    stops = index['fin'].to_numpy()[mask]
+    if not len(starts):
+        return df.iloc[:0]
+    # Los grupos consecutivos (p. ej. todas las actividades de una alcaldía) son un solo slice
+    breaks = np.flatnonzero(starts[1:] != stops[:-1]) + 1
+    starts, stops = starts[np.r_[0, breaks]], stops[np.r_[breaks - 1, len(stops) - 1]]
+    if len(starts) == 1:
+        return df.iloc[starts[0]:stops[0]]
+    return df.take(np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)]))
+
+
+##
+# Perfil de nulos
+##
+# En lugar de dibujar renglón por renglón (missingno), los renglones se agrupan
+# en a lo más `bins` bloques consecutivos y se cuentan los nulos de cada columna
+# en cada bloque. El tamaño del resultado no depende de cuántos renglones haya.
+NULL_BINS = 200
+
+
+def null_profile(df, bins=NULL_BINS):
+    """Nulos por bloque de renglones y columna; la columna 'filas' es el tamaño del bloque."""
+    mask = df.isna().to_numpy()
+    n = len(mask)
+    edges = np.linspace(0, n, min(bins, n) + 1).astype(np.int64)
+    if n:
+        counts = np.add.reduceat(mask, edges[:-1], axis=0, dtype=np.int64)
+    else:
+        counts = np.zeros((0, mask.shape[1]), dtype=np.int64)
+    profile = pd.DataFrame(counts, columns=[str(c) for c in df.columns])
+    profile['filas'] = np.diff(edges)
+    return profile
+
+
+def null_counts(profile):
+    """Total de nulos y porcentaje por columna."""
+    counts = profile.drop(columns='filas').sum()
+    return pd.DataFrame({'nulos': counts, '%': (100 * counts / max(profile['filas'].sum(), 1)).round(2)})
+
+
+def null_density(profile):
+    """Proporción de nulos por bloque de renglones y columna."""
+    return profile.drop(columns='filas').div(profile['filas'], axis=0)
@@ -0,0 +1,300 @@
+##
+# Pruebas de desempeño de las etapas de la app, sin streamlit
+##
+# Mide cada etapa (carga del DENUE, proyección, limpieza de colonias, agregados,
+# describe(), filtro de outliers y construcción de figuras y mapas, y el tamaño
+# del JSON de los puntos de Milpa Alta con y sin compact_deck) con el DENUE incluido
+# en el repositorio y con versiones sintéticas 10x, 100x y 1000x (synthetic.py).
+# En ellas la cantidad de colonias distintas crece con la raíz de la escala
+# (100x renglones, 10x colonias), como en el DENUE nacional. Los listings a
+# escala k son sintéticos (coordenadas, ids y precios distintos), no copias del
+# snapshot, para que los sketches, las celdas y el KD-tree vean cardinalidades reales.
+#
+#   python benchmarks.py                      # compara contra la línea base
+#   python benchmarks.py --save               # guarda la línea base
+#   python benchmarks.py --scales 1 10 --repeat 5 --threshold 0.25
+#   python benchmarks.py --startup            # solamente el tiempo de arranque
+#
+# Regresa 1 si alguna etapa es más lenta o usa más memoria que la línea base
+# por más de `threshold` (proporción), o si el arranque se sale del presupuesto.
+##
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from aggregates import count_cube, group_index, rollup, select_rows, top_n
+from cleaning import normalize_categories
+from figures import compact_bar
+from loaders import (ABB_SNAPSHOT, BOUNDARIES_PATH, CACHE_DIR, DENUE_DTYPES, DENUE_PATH, DENUE_SEP,
+                     file_hash, last_good_snapshot, load_denue, load_listings, sidecar_path)
+from maps import GRID_LEVELS, GRID_ZOOM, grid_levels, point_deck
+from outliers import outlier_bounds, remove_outliers
+from pipeline import materialize_all
+from proximity import nearby
+from summaries import describe_summary, summary_moments, summary_sketch
+from synthetic import denue_template, generate_denue, listings_chunks
+
+BASELINE_PATH = 'benchmarks_baseline.json'
+BENCH_DIR = os.path.join(CACHE_DIR, 'bench')
+SCALES = [1, 10, 100, 1000]
+THRESHOLD = 0.2
+
+# Renglones de listings sintéticos a escala 1 (cuando no hay snapshot local)
+LISTINGS_ROWS = 20_000
+
+# Etapas que no vale la pena comparar (tiempos menores a esto)
+MIN_WALL_S = 0.005
+
+# Módulos que la página importa al arrancar, presupuesto para importarlos (ms)
+# y módulos pesados que solamente deben cargarse en la sección que los usa
+STARTUP_MODULES = ['utils', 'loaders', 'aggregates', 'cleaning', 'figures', 'outliers', 'summaries', 'maps',
+                   'proximity', 'pipeline']
+IMPORT_BUDGET_MS = float(os.environ.get('APP_IMPORT_BUDGET_MS', 3000))
+LAZY_MODULES = ['plotly.express', 'plotly.graph_objects', 'pydeck', 'geopandas', 'matplotlib', 'missingno', 'scipy']
+
+
+def scaled_denue(k, path=DENUE_PATH, out_dir=BENCH_DIR):
+    """DENUE sintético con k veces los renglones; se genera una sola vez."""
+    if k == 1:
+        return path
+    out = os.path.join(out_dir, f'denue_synth_x{k}_{file_hash(path)[:8]}.csv')
+    if not os.path.exists(out):
+        generate_denue(out, k * len(denue_template(path)), seed=k)
+    return out
+
+
+def scaled_listings(k, snapshot=ABB_SNAPSHOT):
+    """Listings del snapshot local a escala 1; a otras escalas (o sin snapshot),
+    k veces esa cantidad de listings sintéticos.
+    """
+    local = last_good_snapshot(snapshot)
+    if local is None:
+        return pd.concat(listings_chunks(k * LISTINGS_ROWS, seed=k), ignore_index=True)
+    df = load_listings(local)
+    if k == 1:
+        return df
+    return pd.concat(listings_chunks(k * len(df), seed=k), ignore_index=True)
+
+
+def measure(func, repeat):
+    """Mejor tiempo de `repeat` corridas y pico de memoria (MB) de una corrida aparte.
+
+    tracemalloc hace más lento el código que mide, así que los tiempos salen de
+    corridas sin él y la memoria de una corrida adicional.
+    """
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'wall_s': round(best, 5), 'peak_mb': round(peak / 2**20, 3)}
+
+
+def startup_imports(modules=STARTUP_MODULES, lazy=LAZY_MODULES):
+    """Importa `modules` en un intérprete nuevo (python -X importtime).
+
+    Regresa el tiempo total en ms, los paquetes que más tardaron [(ms, paquete)],
+    sumando el tiempo propio de sus submódulos, y los módulos de `lazy` que
+    quedaron cargados sin contar los que ya importa streamlit.
+    """
+    code = '; '.join(['import sys', 'import streamlit', 'before = set(sys.modules)']
+                     + [f'import {m}' for m in modules]
+                     + [f'print(",".join(m for m in {lazy!r} if m in set(sys.modules) - before))'])
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, check=True)
+    by_package = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        by_package[package] = by_package.get(package, 0) + int(own) / 1000
+    top = sorted(((ms, name) for name, ms in by_package.items()), reverse=True)[:8]
+    loaded = [m for m in (proc.stdout.strip().splitlines() or [''])[-1].split(',') if m]
+    return sum(by_package.values()), top, loaded
+
+
+def check_startup(budget_ms=IMPORT_BUDGET_MS):
+    """Reporta el tiempo de arranque; regresa (resultados, problemas)."""
+    total, top, loaded = startup_imports()
+    print(f'arranque: {total:.0f} ms (presupuesto {budget_ms:.0f} ms)')
+    for ms, name in top:
+        print(f'  {name:<28} {ms:>10.1f} ms')
+    problems = []
+    if total > budget_ms:
+        problems.append(f'el arranque tarda {total:.0f} ms, más que el presupuesto de {budget_ms:.0f} ms')
+    if loaded:
+        problems.append(f'se cargan al arrancar: {", ".join(loaded)}')
+    return {'imports': {'wall_s': round(total / 1000, 5), 'peak_mb': 0}}, problems
+
+
+def points_payload(df, lat, lon, **kwargs):
+    """Tamaño (KB) del JSON del mapa de puntos escrito por pydeck y por compact_deck."""
+    deck = point_deck(df, lat, lon, GRID_ZOOM['puntos'], **kwargs)
+    return {'pydeck_kb': round(len(deck.pydeck_json()) / 1024, 1), 'payload_kb': round(len(deck.to_json()) / 1024, 1)}
+
+
+def run_scale(k, repeat):
+    results = {}
+
+    def stage(name, func, n=repeat):
+        value, stats = measure(func, n)
+        results[name] = stats
+        print(f'  {name:<28} {stats["wall_s"]:>10.4f} s {stats["peak_mb"]:>10.2f} MB', flush=True)
+        return value
+
+    csv = scaled_denue(k)
+    print(f'x{k}: {csv}', flush=True)
+
+    # Carga
+    stage('denue_read_csv_full', lambda: pd.read_csv(csv, sep=DENUE_SEP))
+    sidecar = sidecar_path(csv, sorted((c, str(t)) for c, t in DENUE_DTYPES.items()))
+
+    def load_cold():
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+        return load_denue(csv)
+    stage('denue_load_cold', load_cold)
+    denue = stage('denue_load_warm', lambda: load_denue(csv))
+
+    # Proyección y limpieza
+    hoteles = stage('hoteles_projection', lambda: denue[['nom_estab', 'nombre_act', 'nomb_asent',
+                                                         'municipio', 'latitud', 'longitud']]
+                    .rename(columns={'municipio': 'alcaldia'}))
+    clean, _ = stage('colonia_cleaning', lambda: normalize_categories(hoteles['nomb_asent'],
+                                                                         by=hoteles['alcaldia']))
+    hoteles = hoteles.assign(nomb_asent=clean)
+
+    # Agregados
+    cube = stage('count_cube', lambda: count_cube(hoteles))
+
+    def rollups():
+        a = rollup(cube, ['nomb_asent', 'alcaldia'])
+        return a, top_n(a, 20), rollup(cube, ['alcaldia', 'nombre_act'])
+    count_a, top_a, count_act = stage('rollups_top_n', rollups)
+
+    # Figuras (sin caché)
+    stage('figure_top20', lambda: compact_bar(top_a, x='nomb_asent', y='count', color='nomb_asent'))
+    stage('figure_facets', lambda: compact_bar(count_act, x='alcaldia', y='count', color='alcaldia',
+                                                     facet_col='nombre_act', facet_col_wrap=2))
+
+    # Filtros
+    groups = stage('group_index', lambda: group_index(hoteles, ['alcaldia', 'nombre_act']))
+    stage('filter_scan', lambda: hoteles[hoteles['alcaldia'] == 'Milpa Alta'])
+    stage('filter_group_index', lambda: select_rows(*groups, alcaldia='Milpa Alta'))
+
+    # Alcaldía por coordenadas, solamente si hay archivo de límites
+    if os.path.exists(BOUNDARIES_PATH):
+        from spatial import DENUE_POINTS, load_boundaries, spatial_join
+        boundaries = load_boundaries(BOUNDARIES_PATH)
+        stage('spatial_join', lambda: spatial_join(denue, *DENUE_POINTS, boundaries))
+
+    # Nodos del DENUE en pipeline.py: calcular todo y, con todo guardado, solamente leer
+    pipeline_dir = os.path.join(BENCH_DIR, f'pipeline_x{k}')
+    denue_nodes = ['cubo', 'hoteles_limpios', 'cubo_limpio'] + [f'celdas_denue_{level}' for level in GRID_LEVELS]
+
+    def pipeline_cold():
+        shutil.rmtree(pipeline_dir, ignore_errors=True)
+        return materialize_all(denue_nodes, {'denue': csv}, cache_dir=pipeline_dir)
+    stage('pipeline_cold', pipeline_cold)
+    stage('pipeline_warm', lambda: materialize_all(denue_nodes, {'denue': csv}, cache_dir=pipeline_dir))
+
+    # AirBnB
+    df_abb = scaled_listings(k)
+    stage('listings_describe', lambda: df_abb.describe())
+    summary = stage('listings_summaries', lambda: (summary_moments(df_abb), summary_sketch(df_abb)))
+    stage('describe_from_summaries', lambda: describe_summary(summary))
+    stage('listings_outliers', lambda: remove_outliers(df_abb, outlier_bounds(df_abb)))
+    stage('grid_levels', lambda: grid_levels(df_abb, 'latitude', 'longitude', 'price', 'room_type'))
+    stage('map_points_json', lambda: point_deck(df_abb, 'latitude', 'longitude', 12, color_by='price').to_json())
+    # Puntos de Milpa Alta con las columnas del tooltip, como en la app
+    payload = points_payload(df_abb[df_abb['neighbourhood'] == 'Milpa Alta'], 'latitude', 'longitude',
+                             color_by='price', columns=['price', 'room_type'])
+    results['map_points_payload'] = payload
+    print(f'  {"map_points_payload":<28} {payload["pydeck_kb"]:>10.1f} KB -> {payload["payload_kb"]:.1f} KB', flush=True)
+    stage('proximity_listings', lambda: nearby(df_abb['latitude'], df_abb['longitude'],
+                                               hoteles['latitud'], hoteles['longitud']))
+    stage('proximity_hotels', lambda: nearby(hoteles['latitud'], hoteles['longitud'],
+                                             df_abb['latitude'], df_abb['longitude']))
+    return results
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    """Etapas con tiempo o memoria mayores a la línea base por más de `threshold`."""
+    flagged = []
+    for scale, stages in current.items():
+        for name, stats in stages.items():
+            base = baseline.get(scale, {}).get(name)
+            if base is None:
+                continue
+            for metric in ('wall_s', 'peak_mb', 'payload_kb'):
+                if metric not in base or metric not in stats:
+                    continue
+                if metric == 'wall_s' and base[metric] < MIN_WALL_S:
+                    continue
+                if base[metric] > 0 and stats[metric] > base[metric] * (1 + threshold):
+                    flagged.append((scale, name, metric, base[metric], stats[metric]))
+    return flagged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pruebas de desempeño de las etapas de la app.')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='guarda los resultados como línea base')
+    parser.add_argument('--startup', action='store_true', help='mide solamente el tiempo de arranque')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_MS, help='ms')
+    args = parser.parse_args()
+
+    startup, problems = check_startup(args.import_budget)
+    for problem in problems:
+        print(f'ARRANQUE: {problem}')
+    if args.startup:
+        sys.exit(1 if problems else 0)
+
+    # Las primeras figuras cargan los validadores de plotly, no se miden
+    compact_bar(pd.DataFrame({'x': ['a'], 'y': [1]}), x='x', y='y')
+    current = {'startup': startup}
+    current.update({f'x{k}': run_scale(k, args.repeat) for k in args.scales})
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'pandas': pd.__version__,
+                    'machine': platform.machine(),
+                    'date': time.strftime('%Y-%m-%d'),
+                },
+                'results': current,
+            }, f, indent=2)
+        print(f'Línea base guardada en {args.baseline}')
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f'No existe {args.baseline}; use --save para crearla.')
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    flagged = compare(current, baseline, args.threshold)
+    for scale, name, metric, base, now in flagged:
+        print(f'REGRESIÓN {scale} {name} {metric}: {base} -> {now}')
+    if not flagged:
+        print('Sin regresiones.')
+    sys.exit(1 if flagged or problems else 0)
@@ -0,0 +1,261 @@
+##
+# Limpieza de los nombres de colonia (nomb_asent)
+##
+# Las correcciones se declaran en la tabla COLONIA_RULES y se aplican a las
+# categorías de la columna, no a cada renglón: el costo depende de cuántas
+# colonias distintas hay y no de cuántos establecimientos.
+##
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregates import label_pairs
+
+# Mapeo revisado de colonias similares (ver suggest_merges más abajo)
+MERGES_PATH = 'data/colonias_similares.csv'
+
+##
+# Tabla de reglas, se aplican en este orden
+##
+# kind:
+#   literal - sustituye la etiqueta completa `pattern` por `repl`
+#   regex   - sustituye las coincidencias de la expresión regular `pattern`
+#   fold    - normaliza: 'spaces' (espacios), 'case' (mayúsculas), 'accents' (acentos, conserva la Ñ)
+#   map     - sustituye según los renglones aprobados del archivo `pattern`, cada uno solamente en
+#             su alcaldía (necesita `by`, ver apply_rules); si el archivo no existe no hace nada
+COLONIA_RULES = {
+    'centr0': {'kind': 'literal', 'pattern': 'CENTR0', 'repl': 'CENTRO'},
+    'centro': {'kind': 'regex', 'pattern': r'^CENTRO.*$', 'repl': 'CENTRO'},
+    'espacios': {'kind': 'fold', 'pattern': 'spaces'},
+    'mayusculas': {'kind': 'fold', 'pattern': 'case'},
+    'acentos': {'kind': 'fold', 'pattern': 'accents'},
+    'similares': {'kind': 'map', 'pattern': MERGES_PATH},
+}
+
+# Marcas diacríticas (NFD) salvo la tilde de la Ñ
+_ACCENTS = r'(?<![Nn])\u0303|[\u0300-\u0302\u0304-\u036f]'
+
+
+def _fold(labels, what):
+    if what == 'spaces':
+        return labels.str.replace(r'\s+', ' ', regex=True).str.strip()
+    if what == 'case':
+        return labels.str.upper()
+    if what == 'accents':
+        return (labels.str.normalize('NFD')
+                      .str.replace(_ACCENTS, '', regex=True)
+                      .str.normalize('NFC'))
+    raise ValueError(f'fold desconocido: {what}')
+
+
+def apply_rule(labels, rule, by=None):
+    """Aplica una regla a una Serie de etiquetas; `by` es la alcaldía de cada etiqueta."""
+    kind = rule['kind']
+    if kind == 'literal':
+        return labels.where(labels != rule['pattern'], rule['repl'])
+    if kind == 'regex':
+        return labels.str.replace(rule['pattern'], rule['repl'], regex=True)
+    if kind == 'fold':
+        return _fold(labels, rule['pattern'])
+    if kind == 'map':
+        mapping = load_merges(rule['pattern'])
+        if not mapping:
+            return labels
+        if by is None:
+            raise ValueError("la regla 'map' necesita la alcaldía de cada etiqueta (by)")
+        new = pd.Series([mapping.get(k) for k in zip(pd.Series(by, dtype=str), labels)], index=labels.index)
+        return labels.where(new.isna(), new)
+    raise ValueError(f'tipo de regla desconocido: {kind}')
+
+
+def apply_rules(labels, names=None, rules=COLONIA_RULES, by=None):
+    """Aplica las reglas `names` (todas si es None) a una Serie de etiquetas.
+
+    `by` es la alcaldía de cada etiqueta; solamente la usan las reglas 'map'.
+    """
+    labels = pd.Series(labels, dtype=str)
+    for name in names or rules:
+        labels = apply_rule(labels, rules[name], by)
+    return labels
+
+
+def normalize_categories(s, names=None, rules=COLONIA_RULES, by=None):
+    """Normaliza una columna categórica aplicando las reglas a sus categorías.
+
+    Con `by` (la alcaldía de cada renglón) las reglas se aplican a las parejas
+    (colonia, alcaldía), como lo necesitan las reglas 'map'. Regresa la columna
+    con los códigos reasignados y un reporte con cuántas categorías (o parejas)
+    y cuántos renglones modificó cada regla.
+    """
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype('category')
+    if by is None:
+        labels, groups = pd.Series(s.cat.categories, dtype=str), None
+        codes = s.cat.codes.to_numpy()
+    else:
+        labels, groups, codes = label_pairs(s, pd.Series(by))
+    # Renglones por categoría (o pareja) original
+    rows = np.bincount(codes[codes >= 0], minlength=len(labels))
+
+    report = []
+    for name in names or rules:
+        rule = rules[name]
+        new = apply_rule(labels, rule, groups)
+        changed = (new != labels).to_numpy()
+        report.append({
+            'regla': name,
+            'tipo': rule['kind'],
+            'categorias': int(changed.sum()),
+            'renglones': int(rows[changed].sum()),
+        })
+        labels = new
+
+    new_cats = pd.unique(labels)
+    remap = pd.Index(new_cats).get_indexer(labels)
+    new_codes = np.where(codes >= 0, remap[codes], -1)
+    out = pd.Series(pd.Categorical.from_codes(new_codes, categories=new_cats),
+                    index=s.index, name=s.name)
+    return out, pd.DataFrame(report)
+
+
+##
+# Detección de colonias similares
+##
+# Sugiere grupos de nombres de colonia casi iguales dentro de una misma alcaldía
+# (p. ej. «CENTR0» y «CENTRO»). Para no comparar todos contra todos, cada nombre
+# se descompone en trigramas y solamente se comparan los nombres que comparten
+# algún trigrama (índice invertido). La similitud es el índice de Jaccard de los
+# trigramas. El resultado es un CSV que se revisa a mano: los renglones con
+# `aprobado` = 1 se aplican con la regla 'similares'.
+#
+#   python cleaning.py suggest [--threshold 0.6] [--out data/colonias_similares.csv]
+##
+
+# Los trigramas que aparecen en más de MAX_POSTINGS nombres de la misma alcaldía
+# no sirven para distinguir candidatos y se omiten
+MAX_POSTINGS = 200
+
+_MERGES = {}
+
+
+def load_merges(path=MERGES_PATH):
+    """Mapeo (alcaldía, nombre) -> nombre canónico de los renglones aprobados del CSV.
+
+    Si un mismo nombre de una alcaldía está aprobado con dos canónicos distintos
+    se lanza ValueError en lugar de quedarse con uno de ellos.
+    """
+    if not os.path.exists(path):
+        return {}
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _MERGES:
+        df = pd.read_csv(path, dtype=str).fillna('')
+        df = df[df['aprobado'].str.strip().str.lower().isin(['1', 'si', 'sí', 'x'])]
+        df = df[['alcaldia', 'nomb_asent', 'canonica']].drop_duplicates()
+        conflicts = df[df.duplicated(['alcaldia', 'nomb_asent'], keep=False)]
+        if len(conflicts):
+            raise ValueError(f'fusiones aprobadas en conflicto en {path}:\n{conflicts.to_string(index=False)}')
+        _MERGES[key] = dict(zip(zip(df['alcaldia'], df['nomb_asent']), df['canonica']))
+    return _MERGES[key]
+
+
+def _gram_set(name):
+    """Trigramas de un nombre en minúsculas, con relleno de espacios."""
+    padded = '  ' + name.lower() + ' '
+    return {padded[j:j + 3] for j in range(len(padded) - 2)}
+
+
+def _trigrams(names):
+    """Renglones (id del nombre, trigrama) de cada nombre."""
+    ids, grams = [], []
+    for i, name in enumerate(names):
+        g = _gram_set(name)
+        ids.extend([i] * len(g))
+        grams.extend(g)
+    return pd.DataFrame({'id': np.array(ids, dtype=np.int64), 'gram': grams})
+
+
+def candidate_pairs(post, blocks, max_postings=MAX_POSTINGS):
+    """Pares (a, b, compartidos) de nombres del mismo bloque con trigramas en común.
+
+    `post` son los renglones (id, trigrama) de _trigrams y `blocks` el bloque de cada nombre.
+    """
+    post = post.copy()
+    post['block'] = np.asarray(blocks)[post['id'].to_numpy()]
+    post['key'] = pd.factorize(pd.MultiIndex.from_arrays([post['block'], post['gram']]))[0]
+    sizes = post.groupby('key')['id'].transform('size')
+    post = post.loc[(sizes > 1) & (sizes <= max_postings), ['key', 'id']]
+
+    pairs = post.merge(post, on='key', suffixes=('_a', '_b'))
+    pairs = pairs[pairs['id_a'] < pairs['id_b']]
+    shared = pairs.groupby(['id_a', 'id_b']).size()
+    return pd.DataFrame({
+        'a': shared.index.get_level_values(0),
+        'b': shared.index.get_level_values(1),
+        'shared': shared.to_numpy(),
+    })
+
+
+def suggest_merges(counts, threshold=0.6, col='nomb_asent', by='alcaldia'):
+    """Grupos de colonias similares a partir de un agregado (`col`, `by`, count).
+
+    Regresa un renglón por nombre a fusionar con su nombre canónico (el de más
+    establecimientos del grupo), la similitud (Jaccard de trigramas) con él y la
+    columna `aprobado` vacía. Un nombre puede quedar en el grupo por parecerse a
+    otro del grupo, así que su similitud con el canónico puede estar bajo el umbral.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    counts = counts.reset_index(drop=True)
+    names = counts[col].astype(str)
+    post = _trigrams(names)
+    pairs = candidate_pairs(post, counts[by].astype(str))
+
+    # Jaccard = compartidos / (|A| + |B| - compartidos), con |X| = trigramas distintos
+    n_grams = np.bincount(post['id'].to_numpy(), minlength=len(names))
+    a, b = pairs['a'].to_numpy(), pairs['b'].to_numpy()
+    score = pairs['shared'].to_numpy() / (n_grams[a] + n_grams[b] - pairs['shared'].to_numpy())
+    keep = score >= threshold
+    a, b, score = a[keep], b[keep], score[keep]
+
+    n = len(names)
+    graph = coo_matrix((np.ones(len(a)), (a, b)), shape=(n, n))
+    _, cluster = connected_components(graph, directed=False)
+
+    out = counts.assign(cluster=cluster)
+    size = out.groupby('cluster')[col].transform('size')
+    out = out[size > 1]
+    # Canónico: el nombre con más establecimientos de cada grupo
+    canon = out.sort_values('count', ascending=False).groupby('cluster')[col].first()
+    out = out.assign(canonica=out['cluster'].map(canon))
+    out = out[out[col] != out['canonica']]
+
+    # Similitud de cada nombre con su canónico (son pocos renglones)
+    out['similitud'] = [round(len(x & y) / len(x | y), 3) for x, y in
+                        zip(map(_gram_set, out[col].astype(str)), map(_gram_set, out['canonica'].astype(str)))]
+    out['aprobado'] = ''
+    return out[[by, col, 'canonica', 'count', 'similitud', 'aprobado']].sort_values([by, 'canonica'])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from aggregates import count_cube, relabel, rollup
+    from loaders import DENUE_PATH, load_denue
+
+    parser = argparse.ArgumentParser(description='Limpieza de nombres de colonia.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_suggest = sub.add_parser('suggest', help='sugiere colonias similares para revisión')
+    p_suggest.add_argument('--denue', default=DENUE_PATH)
+    p_suggest.add_argument('--threshold', type=float, default=0.6)
+    p_suggest.add_argument('--out', default=MERGES_PATH)
+    args = parser.parse_args()
+
+    # Se parte de los nombres ya normalizados con el resto de las reglas
+    names = [n for n, r in COLONIA_RULES.items() if r['kind'] != 'map']
+    cube = count_cube(load_denue(args.denue).rename(columns={'municipio': 'alcaldia'}))
+    cube = relabel(cube, 'nomb_asent', lambda s: apply_rules(s, names))
+    merges = suggest_merges(rollup(cube, ['nomb_asent', 'alcaldia']), args.threshold)
+    merges.to_csv(args.out, index=False)
+    print(f'{len(merges)} sugerencias en {args.out}')
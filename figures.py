@@ -0,0 +1,153 @@
+##
+# Figuras del proyecto
+##
+# Tema común de los gráficos y una fábrica de figuras con caché. No depende de
+# streamlit, así que también se usa fuera de la app (pruebas de desempeño);
+# utils.py reexporta todo para la página. plotly se importa hasta que se
+# construye la primera figura, para no pagarlo al arrancar.
+##
+import hashlib
+import itertools
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+##
+# Tema de los gráficos
+##
+PLOT_BGCOLOR = "#A9BCF5"
+DASHBOARD_BGCOLOR = "#042f47"
+
+PLOT_THEME = {
+    'plot_bgcolor': PLOT_BGCOLOR,
+    'paper_bgcolor': PLOT_BGCOLOR,
+    'font_family':"Cantarell",
+    'font_size': 14,
+    'font_color' :"#0B2161",
+    'title_font_family':"Cantarell",
+    'title_font_color':"black",
+    'legend_title_font_color':"black"
+}
+
+DASHBOARD_THEME = {
+    'paper_bgcolor': DASHBOARD_BGCOLOR,
+}
+
+##
+# Caché de figuras
+##
+# Las figuras se guardan como JSON, con llave el hash de los datos y de los
+# parámetros del gráfico. Si nada cambió, en la siguiente ejecución la figura
+# se recupera del caché sin volver a construirla ni validarla con plotly.
+# El caché es del proceso (compartido por todas las sesiones) y guarda a lo
+# más FIGURE_CACHE_SIZE figuras, descartando las menos usadas.
+FIGURE_CACHE_SIZE = 64
+
+_FIGURES = OrderedDict()
+_FIGURES_LOCK = threading.Lock()
+
+def frame_fingerprint(df):
+    h = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    h.update(repr(list(df.columns)).encode())
+    return h.hexdigest()
+
+def memo_figure(build, *key):
+    """Figura que regresa build(), memorizada según `key`."""
+    key = json.dumps(key, sort_keys=True, default=str)
+    with _FIGURES_LOCK:
+        spec = _FIGURES.get(key)
+        if spec is not None:
+            _FIGURES.move_to_end(key)
+    if spec is None:
+        spec = build().to_json(validate=False)
+        with _FIGURES_LOCK:
+            _FIGURES[key] = spec
+            while len(_FIGURES) > FIGURE_CACHE_SIZE:
+                _FIGURES.popitem(last=False)
+    import plotly.graph_objects as go
+    # El JSON ya fue validado al construir la figura
+    return go.Figure(json.loads(spec), _validate=False)
+
+def px_figure(kind, df, layout=None, theme=PLOT_THEME, compact=False, **params):
+    """Gráfico de plotly express (`kind`: 'bar', 'box', ...) con el tema del
+    proyecto y la figura memorizada según los datos y los parámetros.
+
+    Con compact=True las barras se construyen con compact_bar; con
+    kind='summary_box' `df` son los datos de las cajas (ver summary_box).
+    """
+    def build():
+        import plotly.express as px
+        if compact and kind == 'bar':
+            fig = compact_bar(df, **params)
+        elif kind == 'summary_box':
+            fig = summary_box(df, **params)
+        else:
+            fig = getattr(px, kind)(df, **params)
+        fig.update_layout(theme)
+        if layout:
+            fig.update_layout(layout)
+        return fig
+    return memo_figure(build, kind, frame_fingerprint(df), params, theme, layout, compact)
+
+##
+# Barras compactas
+##
+# px.bar con color= genera una traza por categoría (y por faceta), cada una con
+# su propio estilo. Aquí cada faceta es una sola traza con el color de cada
+# barra en un arreglo, y la leyenda se arma con trazas vacías, una por
+# categoría. La leyenda es solamente informativa: no oculta barras al hacer clic.
+def compact_bar(df, x, y, color=None, facet_col=None, facet_col_wrap=0, labels=None,
+                title=None, width=None, height=None, color_discrete_sequence=None):
+    import plotly.express as px
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    labels = labels or {}
+    color = color or x
+    palette = color_discrete_sequence or px.colors.qualitative.Plotly
+    categories = pd.unique(df[color])
+    colors = dict(zip(categories, itertools.cycle(palette)))
+
+    facets = list(pd.unique(df[facet_col])) if facet_col else [None]
+    ncols = min(facet_col_wrap or len(facets), len(facets))
+    nrows = math.ceil(len(facets) / ncols)
+    titles = [f"{labels.get(facet_col, facet_col)}={f}" for f in facets] if facet_col else None
+    fig = make_subplots(rows=nrows, cols=ncols, subplot_titles=titles,
+                        shared_xaxes='all', shared_yaxes='all',
+                        horizontal_spacing=0.03, vertical_spacing=0.08)
+
+    hover = f"{labels.get(x, x)}=%{{x}}<br>{labels.get(y, y)}=%{{y}}<extra></extra>"
+    for i, facet in enumerate(facets):
+        part = df if facet is None else df[df[facet_col] == facet]
+        fig.add_trace(go.Bar(x=part[x], y=part[y], marker_color=part[color].map(colors),
+                             hovertemplate=hover, showlegend=False),
+                      row=i // ncols + 1, col=i % ncols + 1)
+    for c in categories:
+        fig.add_trace(go.Bar(x=[None], y=[None], name=str(c), marker_color=colors[c]))
+
+    fig.update_xaxes(categoryorder='array', categoryarray=list(pd.unique(df[x])))
+    fig.update_xaxes(title_text=labels.get(x, x), row=nrows)
+    fig.update_yaxes(title_text=labels.get(y, y), col=1)
+    fig.update_layout(title=title, width=width, height=height,
+                      legend_title_text=labels.get(color, color),
+                      legend={'itemclick': False, 'itemdoubleclick': False})
+    return fig
+
+##
+# Box plots a partir de resúmenes
+##
+# go.Box acepta los cuartiles, los bigotes, la media y la desviación estándar
+# ya calculados (ver summaries.box_stats): la caja se dibuja sin enviar los
+# valores al navegador, a cambio de no mostrar los puntos atípicos.
+def summary_box(stats, x, title=None, labels=None, width=None, height=None):
+    import plotly.graph_objects as go
+
+    labels = labels or {}
+    fig = go.Figure(go.Box(x=stats[x], q1=stats['q1'], median=stats['median'], q3=stats['q3'],
+                           lowerfence=stats['lowerfence'], upperfence=stats['upperfence'],
+                           mean=stats['mean'], sd=stats['std'], boxmean='sd'))
+    fig.update_layout(title=title, width=width, height=height, xaxis_title=labels.get(x, x))
+    return fig
@@ -0,0 +1,522 @@
+##
+# Carga de datos del proyecto
+##
+# Estas funciones no dependen de streamlit para poder usarlas también fuera
+# de la app (scripts, pruebas de desempeño). El cacheo lo hace la página: los
+# dataframes base se guardan una vez por proceso con @st.cache_resource() y
+# cada sesión trabaja sobre una vista (ver shared_view).
+##
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pandas as pd
+
+DENUE_PATH = 'data/denue_hoteles_cdmx_2020.csv'
+DENUE_SEP = '|'
+
+# Límites de las alcaldías (Marco Geoestadístico de INEGI), ver spatial.py
+BOUNDARIES_PATH = os.environ.get('ALCALDIAS_PATH', 'data/limites/09mun.shp')
+
+# Directorio de los archivos derivados (sidecars en Parquet)
+CACHE_DIR = 'data/.cache'
+
+##
+# Columnas del DENUE que usa la app y sus tipos
+##
+# Las columnas de texto con pocos valores distintos se guardan como
+# categorías y las coordenadas como float32.
+DENUE_DTYPES = {
+    'nom_estab': str,
+    'nombre_act': 'category',
+    'nomb_asent': 'category',
+    'municipio': 'category',
+    'latitud': 'float32',
+    'longitud': 'float32',
+}
+
+# Memoria de los hashes ya calculados: (ruta, tamaño, mtime) -> hash
+_HASHES = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Hash (sha256) del contenido de un archivo, leído por bloques."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _HASHES:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_size), b''):
+                h.update(block)
+        _HASHES[key] = h.hexdigest()
+    return _HASHES[key]
+
+
+def sidecar_path(path, *parts, cache_dir=CACHE_DIR):
+    """Ruta del Parquet derivado de `path`, ligada a su contenido y a `parts`."""
+    h = hashlib.sha256(file_hash(path).encode())
+    for part in parts:
+        h.update(repr(part).encode())
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{name}.{h.hexdigest()[:16]}.parquet')
+
+
+def write_parquet(df, path):
+    """Escribe `df` en Parquet de forma atómica (archivo temporal + rename)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def sidecar_artifact(path, name, build, cache_dir=CACHE_DIR):
+    """Derivado `name` del archivo `path` (un dataframe), guardado en un Parquet
+    junto a él; se calcula con build() una sola vez por contenido de `path`.
+    """
+    sidecar = sidecar_path(path, name, cache_dir=cache_dir)
+    if os.path.exists(sidecar):
+        return pd.read_parquet(sidecar)
+    df = build()
+    write_parquet(df, sidecar)
+    return df
+
+
+def read_preview(path=DENUE_PATH, nrows=10, sep=DENUE_SEP):
+    """Primeros renglones del archivo con todas sus columnas."""
+    return pd.read_csv(path, sep=sep, nrows=nrows)
+
+
+# Copy-on-write: siempre activo desde pandas 3.0 (requirements.txt); en pandas 2
+# solamente si se activó mode.copy_on_write. Sin él las vistas de shared_view
+# comparten arreglos que una sesión podría modificar para todas.
+COPY_ON_WRITE = int(pd.__version__.split('.')[0]) >= 3 or pd.options.mode.copy_on_write is True
+
+
+def shared_view(df):
+    """Vista de un dataframe compartido entre sesiones.
+
+    Es un dataframe nuevo que usa los mismos arreglos que `df`, sin copiarlos.
+    Con copy-on-write (pandas >= 3) lo que la sesión modifique se copia en ese
+    momento y solamente en la vista, así que el dataframe compartido no cambia.
+    Sin copy-on-write lanza RuntimeError en lugar de compartir los arreglos.
+    """
+    if not COPY_ON_WRITE:
+        raise RuntimeError(f'shared_view necesita copy-on-write (pandas >= 3.0, se tiene {pd.__version__})')
+    return df.copy(deep=False)
+
+
+def load_denue(path=DENUE_PATH, dtypes=DENUE_DTYPES, cache_dir=CACHE_DIR):
+    """Carga las columnas útiles del DENUE.
+
+    La primera vez lee el CSV y guarda un Parquet junto a él; las siguientes
+    lo recupera del Parquet mientras el contenido del CSV no cambie.
+    """
+    sidecar = sidecar_path(path, sorted((c, str(t)) for c, t in dtypes.items()),
+                           cache_dir=cache_dir)
+    if os.path.exists(sidecar):
+        return pd.read_parquet(sidecar)
+
+    df = pd.read_csv(path, sep=DENUE_SEP, usecols=list(dtypes), dtype=dtypes)
+    # usecols no respeta el orden de las columnas
+    df = df[list(dtypes)]
+    write_parquet(df, sidecar)
+    return df
+
+
+##
+# Ingesta del DENUE nacional
+##
+# Los archivos de INEGI con todas las actividades de un sector pesan varios GB.
+# ingest_denue los lee por bloques (record batches de pyarrow); de cada bloque
+# se quedan solamente los renglones de las actividades `codes` (prefijos de
+# codigo_act, por omisión 7211 y 7213: hoteles, moteles, cabañas, pensiones y
+# departamentos amueblados, las actividades del CSV incluido) y de las
+# entidades `entities`, con las columnas de DENUE_DTYPES, y se agregan a un dataset de
+# Parquet particionado por cve_ent. La memoria depende del tamaño del bloque y
+# no del tamaño del archivo.
+#
+#   python loaders.py ingest denue_00_72_csv.csv --sep , --encoding latin-1 --ent 09
+DENUE_DATASET = 'data/denue'
+LODGING_CODES = ['7211', '7213']
+# pyarrow lee por adelantado varias decenas de bloques: la memoria máxima es
+# del orden de 35 x INGEST_BLOCK_SIZE, sin importar el tamaño del archivo
+INGEST_BLOCK_SIZE = 4 << 20
+INGEST_COLUMNS = list(DENUE_DTYPES) + ['codigo_act', 'cve_ent']
+
+
+def _ingest_schema():
+    import pyarrow as pa
+    types = {c: pa.float32() if c in ('latitud', 'longitud') else pa.string() for c in INGEST_COLUMNS}
+    return pa.schema(list(types.items()))
+
+
+def denue_batches(path, codes=LODGING_CODES, entities=None, sep=DENUE_SEP, encoding='utf-8',
+                  block_size=INGEST_BLOCK_SIZE):
+    """Bloques filtrados (pyarrow.RecordBatch) del CSV del DENUE en `path`."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    schema = _ingest_schema()
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(encoding=encoding, block_size=block_size),
+        parse_options=pa_csv.ParseOptions(delimiter=sep),
+        convert_options=pa_csv.ConvertOptions(column_types=dict(zip(schema.names, schema.types)),
+                                              include_columns=schema.names))
+    entities = pa.array([str(e).zfill(2) for e in entities or []], pa.string())
+    for batch in reader:
+        # Algunos archivos traen la entidad sin el cero a la izquierda
+        ent = pc.utf8_lpad(batch.column('cve_ent'), 2, '0')
+        code = batch.column('codigo_act')
+        mask = pc.starts_with(code, codes[0])
+        for prefix in codes[1:]:
+            mask = pc.or_(mask, pc.starts_with(code, prefix))
+        if len(entities):
+            mask = pc.and_(mask, pc.is_in(ent, value_set=entities))
+        batch = pa.RecordBatch.from_arrays(
+            [ent if name == 'cve_ent' else batch.column(name) for name in schema.names], schema=schema)
+        batch = batch.filter(pc.fill_null(mask, False))
+        if batch.num_rows:
+            yield batch
+
+
+def ingest_denue(path, out=DENUE_DATASET, codes=LODGING_CODES, entities=None, sep=DENUE_SEP,
+                 encoding='utf-8', block_size=INGEST_BLOCK_SIZE):
+    """Agrega al dataset `out` los establecimientos filtrados de `path`.
+
+    Los archivos del dataset llevan el nombre del archivo de origen; al volver a
+    ingerir el mismo archivo se reemplazan sus partes y las demás se conservan.
+    Regresa la cantidad de renglones escritos.
+    """
+    import glob
+    import re
+
+    import pyarrow.dataset as ds
+
+    source = re.sub(r'[^\w-]', '_', os.path.splitext(os.path.basename(path))[0])
+    # Solamente las partes de este origen: <source>-<i>.parquet, no las de 'denue-2' si el origen es 'denue'
+    part = re.compile(rf'{re.escape(source)}-\d+\.parquet')
+    for old in glob.glob(os.path.join(out, '*', f'{glob.escape(source)}-*.parquet')):
+        if part.fullmatch(os.path.basename(old)):
+            os.remove(old)
+
+    rows = 0
+    def counted(batches):
+        nonlocal rows
+        for batch in batches:
+            rows += batch.num_rows
+            yield batch
+
+    ds.write_dataset(
+        counted(denue_batches(path, codes, entities, sep, encoding, block_size)),
+        out, schema=_ingest_schema(), format='parquet',
+        partitioning=['cve_ent'], partitioning_flavor='hive',
+        basename_template=f'{source}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore')
+    return rows
+
+
+def load_denue_dataset(root=DENUE_DATASET, entities=None, dtypes=DENUE_DTYPES):
+    """Columnas de DENUE_DTYPES del dataset ingerido, opcionalmente de algunas entidades."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # La partición es texto ('09'), no número
+    partitioning = ds.partitioning(pa.schema([('cve_ent', pa.string())]), flavor='hive')
+    filters = [('cve_ent', 'in', [str(e).zfill(2) for e in entities])] if entities else None
+    df = pd.read_parquet(root, columns=list(dtypes), filters=filters, partitioning=partitioning)
+    return df.astype(dtypes)
+
+
+##
+# Listings detallados (listings.csv.gz)
+##
+# El archivo detallado de Inside Airbnb tiene unas 75 columnas, varias de texto
+# largo (descripciones, amenidades, URLs) y los precios y porcentajes como texto
+# ('$1,234.00', '95%'). read_detailed_listings lo lee por bloques directamente
+# del .gz, solamente con las columnas de DETAILED_COLUMNS. En cada bloque los
+# precios y porcentajes se convierten a números y los textos con pocos valores
+# distintos se guardan como categorías, así que los textos originales nunca
+# están todos en memoria. El resultado tiene las columnas de
+# visualisations/listings.csv (más algunas del detallado) y se guarda como
+# cualquier otro snapshot:
+#
+#   python loaders.py refresh mexico-city/2021-12-25 --source .../data/listings.csv.gz
+
+# columna del archivo -> (columna del resultado, tipo)
+DETAILED_COLUMNS = {
+    'id': ('id', 'id'),
+    'host_id': ('host_id', 'id'),
+    'neighbourhood_group_cleansed': ('neighbourhood_group', 'category'),
+    'neighbourhood_cleansed': ('neighbourhood', 'category'),
+    'latitude': ('latitude', 'float64'),
+    'longitude': ('longitude', 'float64'),
+    'property_type': ('property_type', 'category'),
+    'room_type': ('room_type', 'category'),
+    'accommodates': ('accommodates', 'int'),
+    'bedrooms': ('bedrooms', 'float'),
+    'beds': ('beds', 'float'),
+    'price': ('price', 'currency'),
+    'minimum_nights': ('minimum_nights', 'int'),
+    'number_of_reviews': ('number_of_reviews', 'int'),
+    'last_review': ('last_review', 'date'),
+    'reviews_per_month': ('reviews_per_month', 'float'),
+    'review_scores_rating': ('review_scores_rating', 'float'),
+    'calculated_host_listings_count': ('calculated_host_listings_count', 'int'),
+    'availability_365': ('availability_365', 'int'),
+    'number_of_reviews_ltm': ('number_of_reviews_ltm', 'int'),
+    'host_response_rate': ('host_response_rate', 'percent'),
+    'host_acceptance_rate': ('host_acceptance_rate', 'percent'),
+    'host_is_superhost': ('host_is_superhost', 'bool'),
+    'instant_bookable': ('instant_bookable', 'bool'),
+    'license': ('license', 'category'),
+}
+
+# Como en la ingesta del DENUE, la memoria máxima depende del tamaño del bloque
+DETAILED_BLOCK_SIZE = 4 << 20
+
+
+def is_detailed(source):
+    return source.endswith('.csv.gz')
+
+
+def _detailed_types():
+    import pyarrow as pa
+    arrow = {
+        'id': pa.int64(), 'int': pa.int32(), 'float': pa.float32(), 'float64': pa.float64(),
+        'bool': pa.bool_(), 'date': pa.date32(), 'category': pa.dictionary(pa.int32(), pa.string()),
+        'currency': pa.string(), 'percent': pa.string(),
+    }
+    return {col: arrow[kind] for col, (_, kind) in DETAILED_COLUMNS.items()}
+
+
+def _open_source(source):
+    """Flujo de pyarrow para un archivo local o un URL, descomprimido si es .gz."""
+    import pyarrow as pa
+    compression = 'gzip' if source.endswith('.gz') else None
+    if source.startswith(('http://', 'https://')):
+        from urllib.request import urlopen
+        return pa.input_stream(urlopen(source), compression=compression)
+    return pa.input_stream(source, compression=compression)
+
+
+def detailed_batches(source, block_size=DETAILED_BLOCK_SIZE):
+    """Bloques (pyarrow.RecordBatch) ya convertidos del listings.csv.gz en `source`."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    types = _detailed_types()
+    reader = pa_csv.open_csv(
+        _open_source(source),
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=types, include_columns=list(DETAILED_COLUMNS),
+            true_values=['t'], false_values=['f'], strings_can_be_null=True))
+    for batch in reader:
+        columns = []
+        for col, (_, kind) in DETAILED_COLUMNS.items():
+            values = batch.column(col)
+            if kind == 'currency':
+                # float64: en float32 se pierden los centavos arriba de unos $100,000
+                values = pc.cast(pc.replace_substring_regex(values, r'[$,\s]', ''), pa.float64())
+            elif kind == 'percent':
+                values = pc.cast(pc.replace_substring(values, '%', ''), pa.float32())
+            columns.append(values)
+        yield pa.RecordBatch.from_arrays(columns, names=[name for name, _ in DETAILED_COLUMNS.values()])
+
+
+def read_detailed_listings(source, block_size=DETAILED_BLOCK_SIZE):
+    """Listings detallados de `source` como un dataframe compacto (ver DETAILED_COLUMNS)."""
+    import pyarrow as pa
+    table = pa.Table.from_batches(detailed_batches(source, block_size)).unify_dictionaries()
+    return table.to_pandas(date_as_object=False)
+
+
+##
+# Snapshots de los listings de Inside Airbnb
+##
+# Cada snapshot se identifica por ciudad y fecha, p. ej. 'mexico-city/2021-12-25',
+# y se guarda en data/snapshots/<ciudad>/<fecha>/ como listings.parquet más un
+# manifest.json con el origen, la fecha de descarga y el hash del contenido.
+#
+# La app lee siempre del almacén local; la descarga ocurre solamente si el
+# snapshot no existe o si se pide explícitamente con:
+#
+#   python loaders.py refresh mexico-city/2021-12-25 [--source RUTA_O_URL]
+#
+# El origen puede ser un archivo local o un servidor HTTP local que haga las
+# veces de insideairbnb.com (útil en contenedores sin acceso a internet).
+##
+SNAPSHOT_DIR = 'data/snapshots'
+ABB_SNAPSHOT = 'mexico-city/2021-12-25'
+
+# Plantillas del URL de origen por ciudad
+ABB_SOURCES = {
+    'mexico-city': 'http://data.insideairbnb.com/mexico/df/mexico-city/{date}/visualisations/listings.csv',
+}
+
+
+def snapshot_dir(snapshot, root=SNAPSHOT_DIR):
+    city, date = snapshot.split('/')
+    return os.path.join(root, city, date)
+
+
+def snapshot_source(snapshot, source=None):
+    """Origen del snapshot: el indicado, $ABB_SOURCE o el URL de la ciudad.
+
+    $ABB_SOURCE es el origen del snapshot configurado ($ABB_SNAPSHOT) y no se
+    usa para otras ciudades o fechas, que se guardarían con el contenido equivocado.
+    """
+    if source:
+        return source
+    if os.environ.get('ABB_SOURCE') and snapshot == os.environ.get('ABB_SNAPSHOT', ABB_SNAPSHOT):
+        return os.environ['ABB_SOURCE']
+    city, date = snapshot.split('/')
+    return ABB_SOURCES[city].format(date=date)
+
+
+def read_manifest(snapshot, root=SNAPSHOT_DIR):
+    path = os.path.join(snapshot_dir(snapshot, root), 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def list_snapshots(root=SNAPSHOT_DIR):
+    """Snapshots disponibles en el almacén, ordenados por ciudad y fecha."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        f'{city}/{date}'
+        for city in os.listdir(root)
+        for date in os.listdir(os.path.join(root, city))
+        if os.path.exists(os.path.join(root, city, date, 'manifest.json'))
+    )
+
+
+def save_snapshot(df, snapshot, source, root=SNAPSHOT_DIR):
+    """Guarda `df` en el almacén y escribe su manifiesto."""
+    path = snapshot_dir(snapshot, root)
+    parquet = os.path.join(path, 'listings.parquet')
+    write_parquet(df, parquet)
+    manifest = {
+        'snapshot': snapshot,
+        'source': source,
+        'fetched_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'rows': len(df),
+        'columns': list(df.columns),
+        'sha256': file_hash(parquet),
+    }
+    tmp = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(path, 'manifest.json'))
+    return manifest
+
+
+def fetch_snapshot(snapshot, source=None, root=SNAPSHOT_DIR):
+    """Descarga (o lee del archivo local) el snapshot y lo guarda en el almacén."""
+    source = snapshot_source(snapshot, source)
+    df = read_detailed_listings(source) if is_detailed(source) else pd.read_csv(source)
+    save_snapshot(df, snapshot, source, root)
+    return df
+
+
+def load_listings(snapshot=ABB_SNAPSHOT, source=None, refresh=False, root=SNAPSHOT_DIR):
+    """Listings del snapshot; solo se descargan si faltan o si `refresh`."""
+    if refresh or read_manifest(snapshot, root) is None:
+        return fetch_snapshot(snapshot, source, root)
+    return pd.read_parquet(os.path.join(snapshot_dir(snapshot, root), 'listings.parquet'))
+
+
+def snapshot_artifact(snapshot, name, build, root=SNAPSHOT_DIR):
+    """Derivado `name` del snapshot (un dataframe), guardado junto a él.
+
+    Se calcula con build() una sola vez por versión del snapshot; al
+    actualizarse el snapshot cambia el hash del manifiesto y se recalcula.
+    """
+    manifest = read_manifest(snapshot, root)
+    if manifest is None:
+        return build()
+    path = os.path.join(snapshot_dir(snapshot, root), f"{name}.{manifest['sha256'][:12]}.parquet")
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    df = build()
+    write_parquet(df, path)
+    return df
+
+
+##
+# Carga anticipada en segundo plano
+##
+# La app lanza la carga de los listings al inicio y la sección de AirBnB espera
+# el resultado solamente cuando llega a ella.
+_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+
+
+def prefetch_listings(snapshot=ABB_SNAPSHOT, source=None, root=SNAPSHOT_DIR):
+    """Inicia la carga del snapshot en otro hilo y regresa su Future."""
+    return _EXECUTOR.submit(load_listings, snapshot, source, False, root)
+
+
+def last_good_snapshot(snapshot, root=SNAPSHOT_DIR):
+    """Snapshot local más reciente de la misma ciudad, o None."""
+    city = snapshot.split('/')[0]
+    local = [s for s in list_snapshots(root) if s.split('/')[0] == city]
+    if snapshot in local:
+        return snapshot
+    return local[-1] if local else None
+
+
+def wait_listings(future, snapshot, timeout=None, root=SNAPSHOT_DIR):
+    """Espera la carga anticipada hasta `timeout` segundos.
+
+    Si vence el tiempo o la carga falla se usa la última copia local de la
+    ciudad. Regresa el dataframe y el snapshot que realmente se cargó.
+    """
+    try:
+        return future.result(timeout=timeout), snapshot
+    except Exception:
+        fallback = last_good_snapshot(snapshot, root)
+        if fallback is None:
+            raise
+        if fallback == snapshot and not future.done():
+            # El snapshot ya es local y la carga en curso lo está leyendo: no se lee dos veces
+            return future.result(), snapshot
+        return load_listings(fallback, root=root), fallback
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Almacén local de snapshots de Inside Airbnb e ingesta del DENUE.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_refresh = sub.add_parser('refresh', help='descarga de nuevo un snapshot')
+    p_refresh.add_argument('snapshot', nargs='?', default=ABB_SNAPSHOT)
+    p_refresh.add_argument('--source', help='ruta o URL del listings.csv')
+    sub.add_parser('list', help='muestra los snapshots disponibles')
+    p_ingest = sub.add_parser('ingest', help='agrega un CSV del DENUE al dataset particionado')
+    p_ingest.add_argument('source', help='CSV del DENUE de INEGI')
+    p_ingest.add_argument('--out', default=DENUE_DATASET)
+    p_ingest.add_argument('--codes', nargs='+', default=LODGING_CODES, help='prefijos de codigo_act')
+    p_ingest.add_argument('--ent', nargs='+', help='cve_ent de las entidades (todas si se omite)')
+    p_ingest.add_argument('--sep', default=DENUE_SEP)
+    p_ingest.add_argument('--encoding', default='utf-8')
+    args = parser.parse_args()
+
+    if args.cmd == 'ingest':
+        rows = ingest_denue(args.source, args.out, args.codes, args.ent, args.sep, args.encoding)
+        print(f'{rows:,} renglones agregados a {args.out}')
+    elif args.cmd == 'refresh':
+        fetch_snapshot(args.snapshot, args.source)
+        manifest = read_manifest(args.snapshot)
+        print(json.dumps(manifest, indent=2, ensure_ascii=False))
+    else:
+        for snapshot in list_snapshots():
+            print(snapshot)
@@ -0,0 +1,211 @@
+##
+# Mapas agregados por celdas
+##
+# En lugar de mandar cada establecimiento o listing al navegador, los puntos se
+# agregan en el servidor en celdas cuadradas de una cuadrícula y el mapa
+# (pydeck, ColumnLayer) recibe solamente las celdas: el tamaño de lo que se
+# envía depende de cuántas celdas hay y no de cuántos renglones.
+#
+# Hay un nivel de cuadrícula por escala (GRID_LEVELS, tamaño de celda en
+# metros). Las celdas miden lo mismo en cualquier latitud: cada fila de la
+# cuadrícula tiene su propio ancho en grados de longitud. Por celda se guarda
+# el conteo, la media de `value` (p. ej. el precio) y la categoría más
+# frecuente de `category` (p. ej. nombre_act) con su proporción. Cada nivel es
+# un dataframe, así que se guarda junto al snapshot como cualquier derivado.
+#
+# Para ver de cerca una alcaldía, point_deck dibuja sus puntos sin agregar.
+# No depende de streamlit; pydeck se importa hasta que se arma el mapa.
+##
+import numpy as np
+import pandas as pd
+
+# Nivel -> tamaño de la celda en metros
+GRID_LEVELS = {'ciudad': 2000, 'alcaldia': 500, 'colonia': 150}
+
+# Zoom inicial del mapa para cada nivel (y para los puntos de una alcaldía)
+GRID_ZOOM = {'ciudad': 9.5, 'alcaldia': 11, 'colonia': 13, 'puntos': 12}
+
+METERS_PER_DEGREE = 111_320
+
+# Rampa de color (de bajo a alto) para la media de `value`
+COLOR_LOW = np.array([65, 182, 196])
+COLOR_HIGH = np.array([227, 26, 28])
+
+
+def grid_cells(lat, lon, size):
+    """Fila, columna y centro (lat, lon) de la celda de `size` metros de cada punto."""
+    dlat = size / METERS_PER_DEGREE
+    row = np.floor(np.asarray(lat, dtype=np.float64) / dlat)
+    center_lat = (row + 0.5) * dlat
+    dlon = dlat / np.cos(np.radians(center_lat))
+    col = np.floor(np.asarray(lon, dtype=np.float64) / dlon)
+    return row, col, center_lat, (col + 0.5) * dlon
+
+
+def aggregate_grid(df, lat, lon, size, value=None, category=None):
+    """Celdas de `size` metros con los puntos de `df`: centro, conteo, media de
+    `value` y categoría dominante de `category` (con su proporción).
+
+    Los renglones sin coordenadas se omiten.
+    """
+    la = df[lat].to_numpy(dtype=np.float64)
+    lo = df[lon].to_numpy(dtype=np.float64)
+    valid = np.isfinite(la) & np.isfinite(lo)
+    row, col, clat, clon = grid_cells(la[valid], lo[valid], size)
+
+    # Una llave entera por celda; las columnas caben en 32 bits
+    key = row.astype(np.int64) * (1 << 32) + (col.astype(np.int64) + (1 << 31))
+    cells, first, inv, count = np.unique(key, return_index=True, return_inverse=True, return_counts=True)
+    out = pd.DataFrame({'lat': clat[first], 'lon': clon[first], 'count': count})
+
+    if value is not None:
+        v = df[value].to_numpy(dtype=np.float64)[valid]
+        has = ~np.isnan(v)
+        total = np.bincount(inv, weights=np.where(has, v, 0), minlength=len(cells))
+        n = np.bincount(inv, weights=has, minlength=len(cells))
+        out[f'{value}_media'] = total / np.where(n > 0, n, np.nan)
+
+    if category is not None:
+        cat = df[category].astype('category')
+        codes = cat.cat.codes.to_numpy()[valid].astype(np.int64)
+        k = len(cat.cat.categories) + 1
+        # Conteo por (celda, categoría); los nulos son la categoría k - 1
+        pairs, pair_count = np.unique(inv * k + np.where(codes >= 0, codes, k - 1), return_counts=True)
+        cell, code = pairs // k, pairs % k
+        order = np.lexsort((-pair_count, cell))
+        top = order[np.r_[True, cell[order][1:] != cell[order][:-1]]]
+        labels = np.append(np.asarray(cat.cat.categories, dtype=object), None)
+        out[category] = labels[code[top]]
+        out[f'{category}_pct'] = np.round(100 * pair_count[top] / count, 1)
+    return out
+
+
+def grid_levels(df, lat, lon, value=None, category=None, levels=GRID_LEVELS):
+    """aggregate_grid para cada nivel de `levels`."""
+    return {name: aggregate_grid(df, lat, lon, size, value, category) for name, size in levels.items()}
+
+
+def grid_colors(values, low=None, high=None):
+    """Color RGB de cada celda según `values`, entre COLOR_LOW y COLOR_HIGH.
+
+    Los límites por omisión son los percentiles 5 y 95 para que pocas celdas
+    extremas no dejen a las demás del mismo color.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return np.tile(COLOR_LOW, (len(values), 1))
+    low = np.percentile(finite, 5) if low is None else low
+    high = np.percentile(finite, 95) if high is None else high
+    t = np.clip((values - low) / max(high - low, 1e-9), 0, 1)
+    t = np.where(np.isfinite(t), t, 0)[:, None]
+    return np.round(COLOR_LOW + t * (COLOR_HIGH - COLOR_LOW)).astype(np.uint8)
+
+
+##
+# Datos de las capas
+##
+# pydeck convierte el dataframe de cada capa en una lista de diccionarios (un
+# objeto de Python por renglón) y escribe el mapa con json.dumps e indentación.
+# st.pydeck_chart solamente acepta el mapa como JSON, así que el transporte
+# binario de pydeck (arreglos tipados, solamente para widgets de Jupyter) no
+# está disponible, y las capas de deck.gl esperan una lista de objetos.
+# Los datos siguen yendo por renglón (un objeto JSON por renglón, con los
+# nombres de las columnas repetidos), pero se escriben directamente desde las
+# columnas con el codificador de JSON de pandas, sin pasar por diccionarios de
+# Python, sin indentación, con precisión fija y solamente con las columnas que
+# usa la capa, y se insertan en el JSON del mapa ya armado (ver compact_deck).
+# Lo que se ahorra es sobre todo tiempo de serialización; el tamaño baja
+# alrededor de 2x (ver map_points_payload en benchmarks.py).
+LAYER_PRECISION = 6
+
+# Paleta para colorear por categoría
+CATEGORY_COLORS = np.array([
+    [31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189],
+    [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207],
+])
+
+
+def layer_data(df, precision=LAYER_PRECISION):
+    """Renglones de `df` como JSON (lista de objetos), sin pasar por objetos de Python."""
+    return df.to_json(orient='records', double_precision=precision)
+
+
+def _with_rgb(df, rgb):
+    return df.assign(r=rgb[:, 0], g=rgb[:, 1], b=rgb[:, 2])
+
+
+def compact_deck(layers, view, tooltip=None):
+    """pdk.Deck cuyas capas llevan sus datos ya escritos como JSON (un objeto por renglón).
+
+    `layers` es una lista de (pdk.Layer sin data, dataframe con las columnas de la capa).
+    """
+    import json
+
+    import pydeck as pdk
+
+    class CompactDeck(pdk.Deck):
+        def to_json(self):
+            spec = json.loads(super().to_json())
+            for i, layer in enumerate(spec['layers']):
+                layer['data'] = f'__datos_{i}__'
+            spec = json.dumps(spec, separators=(',', ':'))
+            for i, (_, df) in enumerate(layers):
+                spec = spec.replace(f'"__datos_{i}__"', layer_data(df), 1)
+            return spec
+
+        def pydeck_json(self):
+            """El mismo mapa escrito por pydeck (para comparar, ver benchmarks.py)."""
+            for layer, df in layers:
+                layer.data = df
+            try:
+                return super().to_json()
+            finally:
+                for layer, _ in layers:
+                    layer.data = None
+
+    return CompactDeck(layers=[layer for layer, _ in layers], initial_view_state=view, map_style=None,
+                       tooltip=tooltip)
+
+
+def grid_deck(cells, size, zoom, center=None, color_by=None, tooltip=None, elevation_scale=None):
+    """Mapa de pydeck con una columna por celda, de altura proporcional al conteo."""
+    import pydeck as pdk
+
+    data = _with_rgb(cells, grid_colors(cells[color_by] if color_by else cells['count']))
+    if center is None:
+        center = (data['lat'].mean(), data['lon'].mean()) if len(data) else (19.4, -99.13)
+    # La columna más alta mide unas 10 celdas
+    elevation_scale = elevation_scale or 10 * size / max(int(data['count'].max()) if len(data) else 1, 1)
+    layer = pdk.Layer(
+        'ColumnLayer', get_position=['lon', 'lat'], get_elevation='count',
+        elevation_scale=elevation_scale, radius=size / 2, disk_resolution=4, angle=45,
+        get_fill_color='[r, g, b, 190]', pickable=True, auto_highlight=True,
+    )
+    view = pdk.ViewState(latitude=center[0], longitude=center[1], zoom=zoom, pitch=45)
+    return compact_deck([(layer, data)], view, {'text': tooltip or '{count} puntos'})
+
+
+def point_deck(df, lat, lon, zoom, center=None, color_by=None, category=None, columns=(), radius=25,
+               tooltip=None):
+    """Mapa de pydeck con un punto por renglón, coloreado por `color_by` (numérica) o por `category`.
+
+    A la capa solamente van las coordenadas, el color y `columns` (para el tooltip).
+    """
+    import pydeck as pdk
+
+    data = df[[lon, lat, *columns]].rename(columns={lon: 'lon', lat: 'lat'})
+    if category is not None:
+        codes = df[category].astype('category').cat.codes.to_numpy()
+        rgb = CATEGORY_COLORS[np.where(codes >= 0, codes, 0) % len(CATEGORY_COLORS)]
+    else:
+        rgb = grid_colors(df[color_by] if color_by else np.zeros(len(df)))
+    data = _with_rgb(data, rgb.astype(np.uint8))
+    if center is None:
+        center = (data['lat'].mean(), data['lon'].mean()) if len(data) else (19.4, -99.13)
+    layer = pdk.Layer(
+        'ScatterplotLayer', get_position=['lon', 'lat'], get_fill_color='[r, g, b, 200]',
+        get_radius=radius, radius_min_pixels=2, pickable=True, auto_highlight=True,
+    )
+    view = pdk.ViewState(latitude=center[0], longitude=center[1], zoom=zoom, pitch=0)
+    return compact_deck([(layer, data)], view, {'text': tooltip} if tooltip else None)
@@ -0,0 +1,101 @@
+##
+# Valores atípicos (outliers) por grupo
+##
+# En lugar de un solo límite para toda la ciudad, los límites se calculan por
+# grupo (p. ej. por alcaldía) con alguno de los métodos robustos de
+# OUTLIER_METHODS. Los cuantiles de todos los grupos salen de un solo groupby:
+# exactos hasta EXACT_LIMIT renglones y, con más, aproximados con sketches
+# (ver sketches.py), que no ordenan los datos.
+##
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from sketches import sketch, sketch_quantiles
+
+EXACT_LIMIT = 1_000_000
+
+##
+# Métodos
+##
+# kind:
+#   iqr      - [Q1 - k * IQR, Q3 + k * IQR]
+#   mad      - mediana ± k * MAD / 0.6745, con MAD la mediana de |x - mediana|
+#   quantile - [cuantil low, cuantil high]
+OUTLIER_METHODS = {
+    'iqr': {'kind': 'iqr', 'k': 1.5},
+    'mad': {'kind': 'mad', 'k': 3.5},
+    'quantile': {'kind': 'quantile', 'low': 0.01, 'high': 0.99},
+}
+
+
+def group_quantiles(df, value, by, qs, exact_limit=EXACT_LIMIT):
+    """Cuantiles `qs` de `value` por grupo; un renglón por grupo y una columna por cuantil."""
+    if len(df) <= exact_limit:
+        return df.groupby(by, observed=True)[value].quantile(qs).unstack()
+    return sketch_quantiles(sketch(df, value, by), qs, by).set_index(by)
+
+
+def _group_index(s, keys):
+    """Posición en `keys` del grupo de cada renglón de `s` (-1 si no está)."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes, uniques = s.cat.codes.to_numpy(), s.cat.categories
+    else:
+        codes, uniques = pd.factorize(s)
+    pos = pd.Index(keys).get_indexer(uniques)
+    return np.where(codes >= 0, pos[codes], -1)
+
+
+def bounds_name(method, methods=OUTLIER_METHODS):
+    """Nombre para guardar los límites; cambia si cambian los parámetros del método."""
+    params = json.dumps(methods[method], sort_keys=True).encode()
+    return f'limites_{method}_{hashlib.sha1(params).hexdigest()[:8]}'
+
+
+def outlier_bounds(df, value='price', by='neighbourhood', method='iqr', methods=OUTLIER_METHODS,
+                   exact_limit=EXACT_LIMIT):
+    """Límites de `value` por grupo según `method`: columnas `by`, limite_inf y limite_sup."""
+    rule = methods[method]
+    kind = rule['kind']
+    if kind == 'iqr':
+        q = group_quantiles(df, value, by, [0.25, 0.75], exact_limit)
+        iqr = q[0.75] - q[0.25]
+        low, high = q[0.25] - rule['k'] * iqr, q[0.75] + rule['k'] * iqr
+    elif kind == 'mad':
+        median = group_quantiles(df, value, by, [0.5], exact_limit)[0.5]
+        idx = _group_index(df[by], median.index)
+        dev = np.abs(df[value].to_numpy(dtype=np.float64) - median.to_numpy()[idx])
+        mad = group_quantiles(df[[by]].assign(_dev=dev), '_dev', by, [0.5], exact_limit)[0.5]
+        mad = mad.reindex(median.index)
+        low, high = median - rule['k'] * mad / 0.6745, median + rule['k'] * mad / 0.6745
+    elif kind == 'quantile':
+        q = group_quantiles(df, value, by, [rule['low'], rule['high']], exact_limit)
+        low, high = q[rule['low']], q[rule['high']]
+    else:
+        raise ValueError(f'método desconocido: {kind}')
+    out = pd.DataFrame({'limite_inf': low, 'limite_sup': high})
+    out.index = out.index.astype(str)
+    return out.rename_axis(by).reset_index()
+
+
+def remove_outliers(df, bounds, value='price', by='neighbourhood'):
+    """Quita los renglones fuera de los límites de su grupo.
+
+    Los renglones de grupos sin límites se conservan; los de `value` nulo, no.
+    Regresa el dataframe filtrado y un reporte de renglones eliminados por grupo.
+    """
+    idx = _group_index(df[by], bounds[by])
+    v = df[value].to_numpy(dtype=np.float64)
+    low = bounds['limite_inf'].to_numpy()
+    high = bounds['limite_sup'].to_numpy()
+    inside = (v >= low[idx]) & (v <= high[idx])
+    keep = np.where(idx >= 0, inside, ~np.isnan(v))
+
+    n = len(bounds)
+    rows = np.bincount(idx[idx >= 0], minlength=n)
+    removed = np.bincount(idx[(idx >= 0) & ~keep], minlength=n)
+    report = bounds.assign(renglones=rows, eliminados=removed,
+                           **{'%': np.round(100 * removed / np.maximum(rows, 1), 2)})
+    return df[keep], report[[by, 'renglones', 'eliminados', '%', 'limite_inf', 'limite_sup']]
@@ -0,0 +1,419 @@
+##
+# Datos derivados como un grafo de nodos
+##
+# Cada dataset derivado que usa la app es un nodo de PIPELINE con sus entradas
+# declaradas:
+#
+#   source  - datos de origen: `key(ctx)` da el hash de su contenido (None si aún no
+#             están en disco; calcular una llave nunca descarga nada) y `load(ctx)` los lee
+#   build   - función que recibe los dataframes de `inputs` (en ese orden), `params`
+#             y las llaves de `context` que pida (p. ej. metodo)
+#   files   - archivos que la función lee por su cuenta (p. ej. colonias_similares.csv)
+#   version - opcional, se cambia a mano para recalcular algo que no depende del
+#             código del proyecto (p. ej. una nueva versión de pandas)
+#
+# La llave de un nodo es el hash de su nombre, del código del que depende build
+# (ver _code_hash), de version, params y contexto, del contenido de `files` y de
+# las llaves de sus entradas;
+# la de un source es el hash de su contenido. El resultado se guarda en
+# PIPELINE_DIR/<nodo>.<llave>.parquet, así que al cambiar una regla de limpieza
+# o al llegar un CSV o snapshot nuevo cambian las llaves de ese nodo y de los
+# que dependen de él, y solamente esos se recalculan.
+#
+# El contexto dice de dónde salen los datos (snapshot, CSV del DENUE) y con qué
+# método se eliminan los outliers; por omisión es DEFAULT_CONTEXT.
+#
+#   python pipeline.py status                   # llave de cada nodo y si ya está calculado
+#   python pipeline.py warm [nodos ...]         # calcula lo que falte (todo el grafo por omisión)
+#   python pipeline.py warm --snapshot mexico-city/2021-12-25 --metodo mad
+##
+import ast
+import hashlib
+import inspect
+import json
+import os
+import sys
+import textwrap
+
+import pandas as pd
+
+from aggregates import count_cube, null_profile
+from cleaning import COLONIA_RULES, normalize_categories
+from loaders import (ABB_SNAPSHOT, CACHE_DIR, DENUE_PATH, file_hash, load_denue, load_listings, read_manifest,
+                     write_parquet)
+from maps import GRID_LEVELS, aggregate_grid
+from outliers import OUTLIER_METHODS, outlier_bounds, remove_outliers
+from proximity import PROXIMITY_RADIUS_M, nearby
+from summaries import summary_moments, summary_sketch
+
+PIPELINE_DIR = os.path.join(CACHE_DIR, 'pipeline')
+
+DEFAULT_CONTEXT = {'snapshot': ABB_SNAPSHOT, 'denue': DENUE_PATH, 'metodo': 'iqr'}
+
+# Columnas de los listings que no usa el análisis
+LISTINGS_DROP = ['id', 'host_id', 'neighbourhood_group', 'last_review', 'reviews_per_month',
+                 'calculated_host_listings_count', 'availability_365', 'number_of_reviews_ltm', 'license']
+
+# Archivos que leen las reglas de limpieza de las colonias (fusiones aprobadas)
+RULE_FILES = [rule['pattern'] for rule in COLONIA_RULES.values() if rule['kind'] == 'map']
+
+
+##
+# Orígenes
+##
+def _denue_key(ctx):
+    return file_hash(ctx['denue']) if os.path.exists(ctx['denue']) else None
+
+
+def _listings_key(ctx):
+    manifest = read_manifest(ctx['snapshot'])
+    return None if manifest is None else manifest['sha256']
+
+
+##
+# Funciones de los nodos
+##
+def denue_alcaldias(denue):
+    return denue.rename(columns={'municipio': 'alcaldia'})
+
+
+def _clean_colonias(denue, reglas):
+    hoteles = denue_alcaldias(denue)[['nom_estab', 'nombre_act', 'nomb_asent', 'alcaldia', 'latitud', 'longitud']]
+    nomb_asent, report = normalize_categories(hoteles['nomb_asent'], list(reglas), reglas, by=hoteles['alcaldia'])
+    return hoteles.assign(nomb_asent=nomb_asent), report
+
+
+def clean_hoteles(denue, reglas):
+    return _clean_colonias(denue, reglas)[0]
+
+
+def cleaning_report(denue, reglas):
+    return _clean_colonias(denue, reglas)[1]
+
+
+def raw_cube(denue):
+    return count_cube(denue_alcaldias(denue))
+
+
+def listings_base(listings, columnas):
+    return listings.drop(columns=columnas, errors='ignore')
+
+
+def price_bounds(listings, metodo, metodos):
+    return outlier_bounds(listings, 'price', 'neighbourhood', metodo, metodos)
+
+
+def clean_listings(listings, bounds):
+    return remove_outliers(listings, bounds, 'price', 'neighbourhood')[0]
+
+
+def outliers_report(listings, bounds):
+    return remove_outliers(listings, bounds, 'price', 'neighbourhood')[1]
+
+
+def listings_near_hotels(listings, hoteles, radio):
+    return nearby(listings['latitude'], listings['longitude'], hoteles['latitud'], hoteles['longitud'], radio)
+
+
+def hotels_near_listings(hoteles, listings, radio):
+    return nearby(hoteles['latitud'], hoteles['longitud'], listings['latitude'], listings['longitude'], radio)
+
+
+def listings_grid(listings, size):
+    return aggregate_grid(listings, 'latitude', 'longitude', size, 'price', 'room_type')
+
+
+def denue_grid(denue, size):
+    return aggregate_grid(denue, 'latitud', 'longitud', size, category='nombre_act')
+
+
+##
+# Grafo
+##
+PIPELINE = {
+    # Orígenes
+    'denue': {'source': {'key': _denue_key, 'load': lambda ctx: load_denue(ctx['denue'])}},
+    'listings': {'source': {'key': _listings_key, 'load': lambda ctx: load_listings(ctx['snapshot'])}},
+
+    # DENUE
+    'cubo': {'build': raw_cube, 'inputs': ['denue']},
+    'hoteles_limpios': {'build': clean_hoteles, 'inputs': ['denue'], 'params': {'reglas': COLONIA_RULES},
+                        'files': RULE_FILES},
+    'reporte_limpieza': {'build': cleaning_report, 'inputs': ['denue'], 'params': {'reglas': COLONIA_RULES},
+                         'files': RULE_FILES},
+    'cubo_limpio': {'build': count_cube, 'inputs': ['hoteles_limpios']},
+
+    # AirBnB
+    'nulos': {'build': null_profile, 'inputs': ['listings']},
+    'listings_base': {'build': listings_base, 'inputs': ['listings'], 'params': {'columnas': LISTINGS_DROP}},
+    'resumen_momentos': {'build': summary_moments, 'inputs': ['listings_base']},
+    'resumen_sketch': {'build': summary_sketch, 'inputs': ['listings_base']},
+    'limites_precio': {'build': price_bounds, 'inputs': ['listings_base'], 'context': ['metodo'],
+                       'params': {'metodos': OUTLIER_METHODS}},
+    'listings_limpios': {'build': clean_listings, 'inputs': ['listings_base', 'limites_precio']},
+    'reporte_outliers': {'build': outliers_report, 'inputs': ['listings_base', 'limites_precio']},
+    'resumen_limpio_momentos': {'build': summary_moments, 'inputs': ['listings_limpios']},
+    'resumen_limpio_sketch': {'build': summary_sketch, 'inputs': ['listings_limpios']},
+
+    # Cercanía entre hoteles y listings
+    'cercania_listings': {'build': listings_near_hotels, 'inputs': ['listings_limpios', 'denue'],
+                          'params': {'radio': PROXIMITY_RADIUS_M}},
+    'cercania_hoteles': {'build': hotels_near_listings, 'inputs': ['denue', 'listings_limpios'],
+                         'params': {'radio': PROXIMITY_RADIUS_M}},
+
+    # Celdas de los mapas, un nodo por nivel
+    **{f'celdas_listings_{level}': {'build': listings_grid, 'inputs': ['listings_limpios'], 'params': {'size': size}}
+       for level, size in GRID_LEVELS.items()},
+    **{f'celdas_denue_{level}': {'build': denue_grid, 'inputs': ['denue'], 'params': {'size': size}}
+       for level, size in GRID_LEVELS.items()},
+}
+
+##
+# Código del que depende cada nodo
+##
+# La llave incluye el código de build y de las funciones de su módulo que usa
+# (con las constantes del módulo que lean), y el contenido completo de los
+# otros módulos del proyecto que use, con los que estos importan. Así, cambiar
+# p. ej. la fórmula de outliers.py o METERS_PER_DEGREE de maps.py cambia la llave
+# de los nodos que los usan, aunque build sea solamente una envoltura.
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# func -> (código de func y de sus funciones del mismo módulo, constantes que leen, módulos del proyecto)
+_CODE_DEPS = {}
+# (ruta, mtime) -> módulos del proyecto que importa
+_MODULE_IMPORTS = {}
+
+
+def _local_path(module):
+    """Archivo del módulo `module` (nombre u objeto) si es del proyecto, o None."""
+    if inspect.ismodule(module):
+        path = getattr(module, '__file__', None)
+    else:
+        path = os.path.join(PROJECT_DIR, module.split('.')[0] + '.py')
+    if path and os.path.exists(path) and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR:
+        return os.path.abspath(path)
+    return None
+
+
+def _imported_paths(tree):
+    """Módulos del proyecto importados en `tree` (ast), también dentro de funciones,
+    salvo en el bloque `if __name__ == '__main__'`.
+    """
+    paths = set()
+    body = tree.body if isinstance(tree, ast.Module) else [tree]
+    for top in body:
+        if isinstance(top, ast.If) and '__main__' in ast.unparse(top.test):
+            continue
+        for node in ast.walk(top):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            paths.update(p for p in map(_local_path, names) if p)
+    return paths
+
+
+def _module_closure(paths):
+    """Los módulos `paths` y los del proyecto que importan, directa o indirectamente."""
+    seen, pending = set(), list(paths)
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        key = (path, os.stat(path).st_mtime_ns)
+        if key not in _MODULE_IMPORTS:
+            with open(path, encoding='utf-8') as f:
+                _MODULE_IMPORTS[key] = _imported_paths(ast.parse(f.read()))
+        pending.extend(_MODULE_IMPORTS[key])
+    return seen
+
+
+def _code_deps(func):
+    if func in _CODE_DEPS:
+        return _CODE_DEPS[func]
+    sources, constants, modules = [], set(), set()
+    pending, seen = [func], set()
+    while pending:
+        f = pending.pop()
+        if f in seen:
+            continue
+        seen.add(f)
+        source = inspect.getsource(f)
+        sources.append(source)
+        tree = ast.parse(textwrap.dedent(source))
+        modules |= _imported_paths(tree)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Name) or node.id not in f.__globals__:
+                continue
+            value = f.__globals__[node.id]
+            if inspect.isfunction(value) and value.__module__ == func.__module__:
+                pending.append(value)
+            elif inspect.ismodule(value) or inspect.isfunction(value) or inspect.isclass(value):
+                path = _local_path(value if inspect.ismodule(value) else inspect.getmodule(value))
+                if path:
+                    modules.add(path)
+            elif not callable(value):
+                constants.add((f.__module__, node.id))
+    # El módulo de func se representa por el código de sus funciones, no por el archivo completo
+    modules.discard(_local_path(inspect.getmodule(func)))
+    _CODE_DEPS[func] = (hashlib.sha256('\n'.join(sorted(sources)).encode()).hexdigest(),
+                        sorted(constants), sorted(modules))
+    return _CODE_DEPS[func]
+
+
+def _code_hash(func):
+    """Hash del código del que depende `func` (ver arriba)."""
+    code, constants, modules = _code_deps(func)
+    parts = {
+        'funciones': code,
+        # Por archivo y no por nombre del módulo, que es '__main__' al usar la línea de comandos
+        'constantes': {f'{os.path.basename(sys.modules[m].__file__)}:{n}': repr(vars(sys.modules[m])[n])
+                       for m, n in constants},
+        'modulos': {os.path.basename(p): file_hash(p) for p in sorted(_module_closure(modules))},
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _file_key(path):
+    return file_hash(path) if os.path.exists(path) else 'ausente'
+
+
+def node_key(name, ctx=None, dag=PIPELINE, keys=None):
+    """Llave del nodo `name`: cambia si cambia cualquier cosa de la que depende.
+
+    Es None si alguno de sus orígenes todavía no está en disco.
+    """
+    ctx = {**DEFAULT_CONTEXT, **(ctx or {})}
+    keys = {} if keys is None else keys
+    if name in keys:
+        return keys[name]
+    node = dag[name]
+    if 'source' in node:
+        key = node['source']['key'](ctx)
+    elif any(node_key(i, ctx, dag, keys) is None for i in node.get('inputs', [])):
+        key = None
+    else:
+        parts = {
+            'nodo': name,
+            'codigo': _code_hash(node['build']),
+            'version': node.get('version'),
+            'params': node.get('params', {}),
+            'contexto': {c: ctx[c] for c in node.get('context', [])},
+            'archivos': {f: _file_key(f) for f in node.get('files', [])},
+            'entradas': [node_key(i, ctx, dag, keys) for i in node.get('inputs', [])],
+        }
+        key = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    keys[name] = key
+    return key
+
+
+def node_keys(names, ctx=None, dag=PIPELINE):
+    """Llaves de varios nodos con el mismo contexto.
+
+    La app las usa como llave de su caché en memoria (st.cache_resource), que
+    así se invalida exactamente cuando cambia lo que se guarda en PIPELINE_DIR.
+    """
+    keys = {}
+    return tuple(node_key(name, ctx, dag, keys) for name in names)
+
+
+def node_path(name, key, cache_dir=PIPELINE_DIR):
+    return os.path.join(cache_dir, f'{name}.{key[:16]}.parquet')
+
+
+def node_sources(name, dag=PIPELINE):
+    """Orígenes de los que depende el nodo `name`."""
+    node = dag[name]
+    if 'source' in node:
+        return {name}
+    return set().union(*(node_sources(i, dag) for i in node.get('inputs', [])))
+
+
+def materialize(name, ctx=None, dag=PIPELINE, cache_dir=PIPELINE_DIR, loaded=None, _memo=None, _keys=None):
+    """Dataframe del nodo `name`: lo lee de PIPELINE_DIR o lo calcula (y a las
+    entradas que falten) y lo guarda.
+
+    `loaded` tiene los orígenes que ya están en memoria, p. ej. {'listings': df};
+    se usan en lugar de volver a leerlos.
+    """
+    ctx = {**DEFAULT_CONTEXT, **(ctx or {})}
+    memo = dict(loaded or {}) if _memo is None else _memo
+    keys = {} if _keys is None else _keys
+    if name in memo:
+        return memo[name]
+    node = dag[name]
+    if 'source' in node:
+        # Los orígenes tienen su propio caché (ver loaders.py)
+        memo[name] = node['source']['load'](ctx)
+        return memo[name]
+
+    key = node_key(name, ctx, dag, keys)
+    if key is None:
+        # Falta algún origen (p. ej. un snapshot sin descargar): se carga, lo
+        # que lo deja en disco, y se vuelven a calcular las llaves
+        for source in sorted(node_sources(name, dag)):
+            materialize(source, ctx, dag, cache_dir, _memo=memo, _keys=keys)
+        keys.clear()
+        key = node_key(name, ctx, dag, keys)
+    path = node_path(name, key, cache_dir)
+    if os.path.exists(path):
+        df = pd.read_parquet(path)
+    else:
+        inputs = [materialize(i, ctx, dag, cache_dir, _memo=memo, _keys=keys) for i in node.get('inputs', [])]
+        context = {c: ctx[c] for c in node.get('context', [])}
+        df = node['build'](*inputs, **node.get('params', {}), **context)
+        write_parquet(df, path)
+    memo[name] = df
+    return df
+
+
+def materialize_all(names, ctx=None, dag=PIPELINE, cache_dir=PIPELINE_DIR, loaded=None):
+    """materialize de varios nodos; las entradas comunes se leen una sola vez."""
+    memo, keys = dict(loaded or {}), {}
+    return [materialize(name, ctx, dag, cache_dir, _memo=memo, _keys=keys) for name in names]
+
+
+def pipeline_status(ctx=None, dag=PIPELINE, cache_dir=PIPELINE_DIR):
+    """Llave de cada nodo y si su resultado ya está guardado."""
+    keys = {}
+    rows = []
+    for name, node in dag.items():
+        key = node_key(name, ctx, dag, keys)
+        source = 'source' in node
+        # Sin llave: faltan sus datos de origen, que se descargan con warm
+        rows.append({'nodo': name, 'llave': key and key[:16], 'origen': source,
+                     'calculado': key is not None and (source or os.path.exists(node_path(name, key, cache_dir)))})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Grafo de datos derivados de la app.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    for cmd, help_ in (('status', 'muestra la llave de cada nodo y si ya está calculado'),
+                       ('warm', 'calcula los nodos que falten')):
+        p = sub.add_parser(cmd, help=help_)
+        p.add_argument('--snapshot', default=DEFAULT_CONTEXT['snapshot'])
+        p.add_argument('--denue', default=DEFAULT_CONTEXT['denue'])
+        p.add_argument('--metodo', default=DEFAULT_CONTEXT['metodo'], choices=list(OUTLIER_METHODS))
+        if cmd == 'warm':
+            p.add_argument('nodes', nargs='*', help='nodos a calcular (todos si se omite)')
+    args = parser.parse_args()
+    ctx = {'snapshot': args.snapshot, 'denue': args.denue, 'metodo': args.metodo}
+
+    if args.cmd == 'status':
+        print(pipeline_status(ctx).to_string(index=False))
+    else:
+        memo, keys = {}, {}
+        for name in args.nodes or list(PIPELINE):
+            key = node_key(name, ctx, keys=keys)
+            cached = key is not None and os.path.exists(node_path(name, key))
+            t = time.perf_counter()
+            df = materialize(name, ctx, _memo=memo, _keys=keys)
+            state = 'en caché' if cached or 'source' in PIPELINE[name] else 'calculado'
+            print(f'{name:<28} {len(df):>12,} renglones  {state:<10} {time.perf_counter() - t:8.2f} s', flush=True)
@@ -0,0 +1,99 @@
+##
+# Cercanía entre hoteles del DENUE y listings de AirBnB
+##
+# Para cada listing se calcula la distancia al hotel más cercano y cuántos
+# hoteles hay a menos de `radius` metros, y lo mismo para cada hotel respecto a
+# los listings. En lugar de la matriz de todas las distancias, las coordenadas
+# se pasan a puntos sobre la esfera unitaria (x, y, z) y se busca en un KD-tree
+# (scipy.spatial.cKDTree): la distancia en línea recta entre dos de esos puntos
+# (cuerda) crece con la distancia sobre la superficie, así que el vecino más
+# cercano y los vecinos dentro de un radio son los mismos que con haversine, y
+# funciona igual para la CDMX que para todo el país.
+#
+# Los resultados por renglón se agregan por alcaldía en competition_kpis.
+#
+# scipy se importa hasta que se arma el KD-tree: pipeline.py importa este
+# módulo (nearby, PROXIMITY_RADIUS_M) y la app lo carga al arrancar.
+##
+import numpy as np
+import pandas as pd
+
+# Radio medio de la Tierra (m)
+EARTH_RADIUS_M = 6_371_008.8
+
+# Radio para contar hoteles o listings cercanos (m)
+PROXIMITY_RADIUS_M = 500
+
+# Renglones por bloque de consultas; acota la memoria de los resultados intermedios
+PROXIMITY_CHUNK = 1_000_000
+
+
+def unit_vectors(lat, lon):
+    """Coordenadas (grados) como puntos (x, y, z) sobre la esfera unitaria."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord(meters):
+    """Distancia en metros sobre la superficie -> cuerda en la esfera unitaria."""
+    return 2 * np.sin(np.asarray(meters, dtype=np.float64) / (2 * EARTH_RADIUS_M))
+
+
+def arc_meters(c):
+    """Cuerda en la esfera unitaria -> distancia en metros sobre la superficie."""
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.clip(c / 2, 0, 1))
+
+
+def _tree(lat, lon):
+    from scipy.spatial import cKDTree
+
+    xyz = unit_vectors(lat, lon)
+    return cKDTree(xyz[np.isfinite(xyz).all(axis=1)])
+
+
+def nearby(lat, lon, target_lat, target_lon, radius=PROXIMITY_RADIUS_M, chunk=PROXIMITY_CHUNK):
+    """Para cada punto, distancia (m) al objetivo más cercano y objetivos a menos de `radius` m.
+
+    Los puntos sin coordenadas quedan con distancia nula y conteo 0.
+    """
+    tree = _tree(target_lat, target_lon)
+    xyz = unit_vectors(lat, lon)
+    n = len(xyz)
+    dist = np.full(n, np.nan)
+    count = np.zeros(n, dtype=np.int64)
+    valid = np.flatnonzero(np.isfinite(xyz).all(axis=1))
+    if tree.n == 0:
+        return pd.DataFrame({'distancia_m': dist, 'cercanos': count})
+    r = chord(radius)
+    for start in range(0, len(valid), chunk):
+        idx = valid[start:start + chunk]
+        d, _ = tree.query(xyz[idx], k=1, workers=-1)
+        dist[idx] = arc_meters(d)
+        count[idx] = tree.query_ball_point(xyz[idx], r, return_length=True, workers=-1)
+    return pd.DataFrame({'distancia_m': dist, 'cercanos': count})
+
+
+def competition_kpis(listings, hotels, listings_by='neighbourhood', hotels_by='municipio'):
+    """Indicadores por alcaldía a partir de los resultados de nearby de cada lado.
+
+    `listings` y `hotels` tienen la alcaldía y las columnas distancia_m y cercanos.
+    """
+    lst = listings.assign(con_hotel=listings['cercanos'] > 0).groupby(listings_by, observed=True).agg(
+        listings=('cercanos', 'size'),
+        dist_hotel_mediana_m=('distancia_m', 'median'),
+        hoteles_cerca_promedio=('cercanos', 'mean'),
+        pct_con_hotel_cerca=('con_hotel', 'mean'),
+    )
+    htl = hotels.groupby(hotels_by, observed=True).agg(
+        hoteles=('cercanos', 'size'),
+        dist_listing_mediana_m=('distancia_m', 'median'),
+        listings_cerca_promedio=('cercanos', 'mean'),
+    )
+    lst.index = lst.index.astype(str)
+    htl.index = htl.index.astype(str)
+    out = lst.join(htl, how='outer').rename_axis('alcaldia').reset_index()
+    out['pct_con_hotel_cerca'] = (100 * out['pct_con_hotel_cerca']).round(1)
+    out[['listings', 'hoteles']] = out[['listings', 'hoteles']].fillna(0).astype(np.int64)
+    return out
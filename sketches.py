@@ -0,0 +1,90 @@
+##
+# Cuantiles aproximados que se pueden combinar (sketches)
+##
+# Para no ordenar todos los valores, cada valor se asigna a una cubeta
+# logarítmica (como en DDSketch): la cubeta k de los positivos cubre
+# (gamma^(k-1), gamma^k] con gamma = (1 + alpha) / (1 - alpha), así que
+# cualquier cuantil se recupera con error relativo de a lo más `alpha`.
+#
+# Un sketch es un dataframe con las columnas de grupo más origin, sign, key y
+# count (renglones por cubeta). Se construye con un solo groupby, se guarda en
+# Parquet como cualquier dataframe y dos sketches se combinan sumando los
+# conteos de las mismas cubetas, sin volver a leer los datos.
+#
+# El error es relativo a la distancia de cada valor a `origin` (0 por omisión).
+# Para datos lejos del cero comparados con su dispersión (p. ej. coordenadas)
+# conviene usar un origen cercano a ellos, como la media. Solamente se combinan
+# sketches del mismo grupo con el mismo origen.
+##
+import numpy as np
+import pandas as pd
+
+# Error relativo de los cuantiles
+SKETCH_ALPHA = 0.01
+
+# Los valores absolutos menores a esto cuentan como cero
+SKETCH_MIN = 1e-9
+
+
+def _gamma(alpha):
+    return (1 + alpha) / (1 - alpha)
+
+
+def _as_list(by):
+    if by is None:
+        return []
+    return [by] if isinstance(by, str) else list(by)
+
+
+def sketch(df, value, by=None, alpha=SKETCH_ALPHA, origin=0.0):
+    """Sketch de la columna `value` de `df` por grupo (`by`); se omiten los nulos."""
+    by = _as_list(by)
+    df = df[by + [value]].dropna(subset=[value])
+    v = df[value].to_numpy(dtype=np.float64) - origin
+    sign = np.sign(v).astype(np.int8)
+    sign[np.abs(v) < SKETCH_MIN] = 0
+    with np.errstate(divide='ignore'):
+        key = np.ceil(np.log(np.abs(v)) / np.log(_gamma(alpha)))
+    key = np.where(sign == 0, 0, key).astype(np.int32)
+    parts = df[by].assign(origin=float(origin), sign=sign, key=key)
+    return (parts.groupby(by + ['origin', 'sign', 'key'], observed=True, sort=False)
+                 .size().rename('count').reset_index())
+
+
+def merge_sketches(sketches, by=None):
+    """Combina varios sketches (o agrega un sketch a menos grupos, p. ej. by=None)."""
+    by = _as_list(by)
+    return (pd.concat(sketches, ignore_index=True)
+              .groupby(by + ['origin', 'sign', 'key'], observed=True, sort=False)['count'].sum().reset_index())
+
+
+def sketch_quantiles(sk, qs, by=None, alpha=SKETCH_ALPHA):
+    """Cuantiles `qs` de cada grupo del sketch; un renglón por grupo y una columna por cuantil."""
+    by = _as_list(by)
+    gamma = _gamma(alpha)
+    # Orden de las cubetas: negativos (de mayor a menor magnitud), cero, positivos
+    sk = sk.assign(_order=sk['sign'].astype(np.int64) * sk['key'])
+    sk = sk.sort_values(by + ['sign', '_order'], kind='stable')
+    value = sk['origin'] + sk['sign'] * 2 * gamma ** sk['key'].astype(np.float64) / (gamma + 1)
+
+    if by:
+        group = sk.groupby(by, observed=True, sort=False).ngroup().to_numpy()
+    else:
+        group = np.zeros(len(sk), dtype=np.int64)
+    counts = sk['count'].to_numpy(dtype=np.int64)
+    cum = np.cumsum(counts)
+    n_groups = group.max() + 1 if len(group) else 0
+    totals = np.bincount(group, weights=counts, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(totals)[:-1]])
+
+    # Para cada grupo y cuantil, la primera cubeta cuyo acumulado supera el rango
+    out = {}
+    for q in qs:
+        rank = starts + q * (totals - 1)
+        idx = np.searchsorted(cum, rank, side='right')
+        out[q] = value.to_numpy()[np.minimum(idx, len(cum) - 1)]
+    result = pd.DataFrame(out)
+    if by:
+        keys = sk[by].drop_duplicates().reset_index(drop=True)
+        result = pd.concat([keys, result], axis=1)
+    return result
@@ -0,0 +1,147 @@
+##
+# Alcaldía a partir de las coordenadas (spatial join)
+##
+# El DENUE (municipio) y los listings (neighbourhood) traen la alcaldía como
+# texto capturado a mano. Con la latitud y longitud de cada renglón se busca el
+# polígono que lo contiene en un archivo local de límites, por omisión el de
+# municipios del Marco Geoestadístico de INEGI para la CDMX (09mun.shp, columna
+# NOMGEO). Sirve cualquier archivo que lea geopandas (shp, gpkg, geojson), así
+# que con el de colonias o AGEB (09a.shp, columna CVEGEO) se asigna ese nivel.
+#
+# Los puntos se crean de una sola vez con shapely.points y se buscan todos
+# juntos en el índice espacial (STRtree) de los polígonos, como en
+# geopandas.sjoin pero sin armar un GeoDataFrame de puntos; la prueba exacta se
+# hace después, un polígono a la vez y con la geometría preparada. El resultado se
+# guarda junto al snapshot (o junto al CSV del DENUE), ligado al contenido del
+# archivo de límites, así que se calcula una vez por versión.
+#
+#   python spatial.py check [--boundaries data/limites/09mun.shp] [--snapshot mexico-city/2021-12-25]
+##
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from cleaning import apply_rules
+from loaders import (ABB_SNAPSHOT, BOUNDARIES_PATH, DENUE_PATH, file_hash, load_denue, load_listings,
+                     sidecar_artifact, snapshot_artifact)
+
+BOUNDARY_NAME = 'NOMGEO'
+
+# Etiqueta de los puntos que no caen en ningún polígono
+OUTSIDE = 'Sin polígono'
+
+# Columnas de coordenadas y de alcaldía declarada de cada fuente
+DENUE_POINTS = ('latitud', 'longitud', 'municipio')
+LISTINGS_POINTS = ('latitude', 'longitude', 'neighbourhood')
+
+
+def load_boundaries(path=BOUNDARIES_PATH, name=BOUNDARY_NAME):
+    """Polígonos del archivo `path` en coordenadas geográficas (EPSG:4326)."""
+    gdf = gpd.read_file(path, columns=[name])
+    if gdf.crs is None:
+        gdf = gdf.set_crs(4326)
+    return gdf.to_crs(4326)[[name, 'geometry']].reset_index(drop=True)
+
+
+def assign_polygons(lat, lon, boundaries, name=BOUNDARY_NAME):
+    """Nombre del polígono que contiene cada punto (nulo si no cae en ninguno).
+
+    Un punto sobre la frontera de dos polígonos se asigna al primero.
+    """
+    x = np.asarray(lon, dtype=np.float64)
+    y = np.asarray(lat, dtype=np.float64)
+    # El índice solamente compara rectángulos: parejas (punto, polígono) candidatas
+    hit, poly = boundaries.sindex.query(shapely.points(x, y))
+    order = np.argsort(poly, kind='stable')
+    hit, poly = hit[order], poly[order]
+
+    # La prueba exacta se hace por polígono, con la geometría preparada y las
+    # coordenadas directamente (intersects_xy), sin comparar punto por punto
+    geoms = np.asarray(boundaries.geometry.array, dtype=object)
+    shapely.prepare(geoms)
+    first = np.full(len(x), -1, dtype=np.int64)
+    edges = np.flatnonzero(np.r_[True, poly[1:] != poly[:-1], True]) if len(poly) else []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        p, idx = poly[start], hit[start:stop]
+        idx = idx[shapely.intersects_xy(geoms[p], x[idx], y[idx])]
+        idx = idx[first[idx] < 0]
+        first[idx] = p
+    names = pd.Index(boundaries[name].astype(str).unique())
+    codes = names.get_indexer(boundaries[name].astype(str))
+    return pd.Categorical.from_codes(np.where(first >= 0, codes[first], -1), categories=names)
+
+
+def _fold_names(labels):
+    return apply_rules(labels, ['espacios', 'mayusculas', 'acentos']).to_numpy()
+
+
+def spatial_join(df, lat, lon, declared, boundaries, name=BOUNDARY_NAME):
+    """Polígono de cada renglón de `df` y si coincide con la columna `declared`.
+
+    Regresa un dataframe con los mismos renglones: alcaldia_geo y coincide
+    (nulo si el renglón no cae en ningún polígono). Los nombres se comparan sin
+    importar espacios, mayúsculas ni acentos.
+    """
+    geo = pd.Series(assign_polygons(df[lat], df[lon], boundaries, name), name='alcaldia_geo')
+    declared = pd.Series(df[declared].to_numpy(), dtype='category')
+    # Se normalizan las categorías (pocas) y no cada renglón
+    same = (pd.Series(_fold_names(declared.cat.categories)).reindex(declared.cat.codes).to_numpy()
+            == pd.Series(_fold_names(geo.cat.categories)).reindex(geo.cat.codes).to_numpy())
+    coincide = pd.array(same, dtype='boolean')
+    coincide[geo.isna().to_numpy()] = pd.NA
+    return pd.DataFrame({'alcaldia_geo': geo, 'coincide': coincide})
+
+
+def boundaries_name(path=BOUNDARIES_PATH, name=BOUNDARY_NAME):
+    """Nombre para guardar la asignación; cambia si cambia el archivo de límites."""
+    return f'poligonos_{name}_{file_hash(path)[:12]}'
+
+
+def join_denue(path=DENUE_PATH, boundaries_path=BOUNDARIES_PATH, name=BOUNDARY_NAME):
+    """spatial_join del DENUE de `path`, guardado en un Parquet junto al CSV."""
+    return sidecar_artifact(path, boundaries_name(boundaries_path, name), lambda: spatial_join(
+        load_denue(path), *DENUE_POINTS, load_boundaries(boundaries_path, name), name))
+
+
+def join_listings(snapshot, df, boundaries_path=BOUNDARIES_PATH, name=BOUNDARY_NAME):
+    """spatial_join de los listings `df` del snapshot, guardado junto a él."""
+    return snapshot_artifact(snapshot, boundaries_name(boundaries_path, name),
+                             lambda: spatial_join(df, *LISTINGS_POINTS, load_boundaries(boundaries_path, name), name))
+
+
+def mismatch_report(declared, joined):
+    """Renglones por alcaldía declarada y alcaldía según las coordenadas, cuando no coinciden."""
+    out = pd.DataFrame({
+        'declarada': pd.Series(declared).astype(str).to_numpy(),
+        'alcaldia_geo': joined['alcaldia_geo'].astype(str).where(joined['alcaldia_geo'].notna(), OUTSIDE).to_numpy(),
+        'coincide': joined['coincide'].fillna(False).to_numpy(dtype=bool),
+    })
+    out = out[~out['coincide']]
+    return (out.groupby(['declarada', 'alcaldia_geo']).size().rename('renglones')
+               .reset_index().sort_values('renglones', ascending=False, ignore_index=True))
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Compara la alcaldía declarada con la de las coordenadas.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_check = sub.add_parser('check', help='calcula (o lee) la asignación y muestra las diferencias')
+    p_check.add_argument('--boundaries', default=BOUNDARIES_PATH)
+    p_check.add_argument('--name', default=BOUNDARY_NAME, help='columna con el nombre del polígono')
+    p_check.add_argument('--denue', default=DENUE_PATH)
+    p_check.add_argument('--snapshot', default=ABB_SNAPSHOT)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    joined = join_denue(args.denue, args.boundaries, args.name)
+    print(f'DENUE: {len(joined):,} renglones ({time.perf_counter() - t:.1f} s)')
+    print(mismatch_report(load_denue(args.denue)[DENUE_POINTS[2]], joined).to_string())
+
+    t = time.perf_counter()
+    listings = load_listings(args.snapshot)
+    joined = join_listings(args.snapshot, listings, args.boundaries, args.name)
+    print(f'Listings: {len(joined):,} renglones ({time.perf_counter() - t:.1f} s)')
+    print(mismatch_report(listings[LISTINGS_POINTS[2]], joined).to_string())
@@ -0,0 +1,121 @@
+##
+# Resúmenes estadísticos por grupo
+##
+# En lugar de recorrer los renglones para cada KPI, tabla o gráfico, se calcula
+# una sola vez por grupo (alcaldía) y columna numérica:
+#
+#   momentos - renglones, count, mean, m2 (suma de cuadrados de las desviaciones,
+#              como en el algoritmo de Welford), min y max
+#   sketch   - cubetas de cuantiles aproximados (ver sketches.py)
+#
+# Los dos son dataframes, se guardan junto al snapshot y se combinan sin volver
+# a leer los datos: merge_moments junta los momentos de varios grupos con la
+# fórmula de Chan et al. y merge_sketches suma las cubetas. Con ellos se arman
+# describe(), los KPI y las cajas de los box plots de cualquier alcaldía.
+##
+import numpy as np
+import pandas as pd
+
+from sketches import SKETCH_ALPHA, merge_sketches, sketch, sketch_quantiles
+
+SUMMARY_QUANTILES = [0.25, 0.5, 0.75]
+
+
+def numeric_columns(df, by):
+    return [c for c in df.columns
+            if c != by and pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+
+
+def summary_moments(df, by='neighbourhood', columns=None):
+    """Momentos de cada columna numérica por grupo; un renglón por (grupo, columna)."""
+    columns = columns or numeric_columns(df, by)
+    g = df.groupby(by, observed=True)
+    stats = g[columns].agg(['count', 'mean', 'var', 'min', 'max'])
+    stats.columns = stats.columns.set_names(['columna', None])
+    out = stats.stack('columna', future_stack=True).reset_index()
+    out['m2'] = out['var'].fillna(0) * (out['count'] - 1).clip(lower=0)
+    out['renglones'] = out[by].map(g.size())
+    out[by] = out[by].astype(str)
+    return out[[by, 'columna', 'renglones', 'count', 'mean', 'm2', 'min', 'max']]
+
+
+def sketch_origin(s):
+    """Origen del sketch de `s`: la media si los datos están lejos del cero, si no 0."""
+    mean, std = s.mean(), s.std()
+    return float(mean) if abs(mean) > std else 0.0
+
+
+def summary_sketch(df, by='neighbourhood', columns=None, alpha=SKETCH_ALPHA):
+    """Sketches de cada columna numérica por grupo, con la columna en `columna`."""
+    columns = columns or numeric_columns(df, by)
+    parts = [sketch(df, c, by, alpha, sketch_origin(df[c])).assign(columna=c) for c in columns]
+    out = pd.concat(parts, ignore_index=True)
+    out[by] = out[by].astype(str)
+    return out
+
+
+def merge_moments(moments, by=None):
+    """Combina los momentos de los grupos; `by` son las columnas que se conservan."""
+    keys = ([by] if isinstance(by, str) else list(by or [])) + ['columna']
+    m = moments.assign(_sum=moments['mean'].fillna(0) * moments['count'])
+    g = m.groupby(keys, observed=True, sort=False)
+    out = g.agg(renglones=('renglones', 'sum'), count=('count', 'sum'), _sum=('_sum', 'sum'),
+                min=('min', 'min'), max=('max', 'max')).reset_index()
+    out['mean'] = out['_sum'] / out['count'].where(out['count'] > 0)
+    # m2 = sum(m2_i + n_i * (mean_i - mean)^2)
+    mean = m[keys].merge(out[keys + ['mean']], on=keys, how='left')['mean'].to_numpy()
+    dev = m['count'].to_numpy() * (m['mean'].fillna(0).to_numpy() - mean) ** 2
+    m2 = m.assign(_m2=m['m2'].to_numpy() + np.nan_to_num(dev)).groupby(keys, observed=True, sort=False)['_m2'].sum()
+    out['m2'] = m2.to_numpy()
+    return out[keys + ['renglones', 'count', 'mean', 'm2', 'min', 'max']]
+
+
+def _select(summary, groups, by):
+    moments, sk = summary
+    if groups is None:
+        return moments, sk
+    return moments[moments[by].isin(groups)], sk[sk[by].isin(groups)]
+
+
+def describe_summary(summary, groups=None, by='neighbourhood', qs=SUMMARY_QUANTILES):
+    """Tabla como la de df.describe() de los grupos `groups` (todos si es None).
+
+    Los percentiles son aproximados (error relativo de SKETCH_ALPHA).
+    """
+    moments, sk = _select(summary, groups, by)
+    m = merge_moments(moments).set_index('columna')
+    q = sketch_quantiles(merge_sketches([sk], 'columna'), qs, 'columna').set_index('columna')
+    # La cubeta puede quedar un poco fuera del rango de los datos
+    q = q.reindex(m.index).clip(lower=m['min'], upper=m['max'], axis=0)
+    columns = list(pd.unique(moments['columna']))
+    table = pd.DataFrame({
+        'count': m['count'],
+        'mean': m['mean'],
+        'std': np.sqrt(m['m2'] / (m['count'] - 1).where(m['count'] > 1)),
+        'min': m['min'],
+        **{f'{100 * p:g}%': q[p] for p in qs},
+        'max': m['max'],
+    })
+    return table.reindex(columns).T
+
+
+def group_stats(summary, column, by='neighbourhood'):
+    """renglones, count, mean, std, min y max de `column` por grupo."""
+    m = summary[0]
+    m = m[m['columna'] == column].reset_index(drop=True)
+    std = np.sqrt(m['m2'] / (m['count'] - 1).where(m['count'] > 1))
+    return m[[by, 'renglones', 'count', 'mean', 'min', 'max']].assign(std=std)
+
+
+def box_stats(summary, column, groups=None, by='neighbourhood'):
+    """Datos de la caja de `column` por grupo: cuartiles, bigotes (1.5 IQR), media y std."""
+    moments, sk = _select(summary, groups, by)
+    sk = sk[sk['columna'] == column]
+    q = sketch_quantiles(sk, SUMMARY_QUANTILES, by)
+    stats = group_stats((moments, sk), column, by)
+    out = q.merge(stats, on=by).rename(columns={0.25: 'q1', 0.5: 'median', 0.75: 'q3'})
+    out[['q1', 'median', 'q3']] = out[['q1', 'median', 'q3']].clip(lower=out['min'], upper=out['max'], axis=0)
+    iqr = out['q3'] - out['q1']
+    out['lowerfence'] = np.maximum(out['min'], out['q1'] - 1.5 * iqr)
+    out['upperfence'] = np.minimum(out['max'], out['q3'] + 1.5 * iqr)
+    return out
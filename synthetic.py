@@ -0,0 +1,211 @@
+##
+# Generador de datos sintéticos del DENUE y de Inside Airbnb
+##
+# Sirve para probar la app y medir su desempeño sin conexión y a escala de
+# producción. Los datos se generan por bloques (chunks) y se escriben en el CSV
+# conforme se generan, así que la memoria no depende del total de renglones.
+# Con la misma semilla y el mismo tamaño de bloque el resultado es idéntico.
+#
+#   python synthetic.py denue --rows 10000000 --out data/.cache/synth/denue.csv
+#   python synthetic.py listings --rows 2000000 --out data/.cache/synth/listings.csv --seed 7
+#
+# DENUE: mismo esquema de 40 columnas separadas por '|'. Cada renglón parte de
+# un renglón del DENUE incluido, así que se conservan las distribuciones de
+# codigo_act / nombre_act / municipio; el nombre, el número exterior y las
+# coordenadas cambian, y las colonias tienen variantes para que su cantidad
+# crezca con la raíz del tamaño (como en el DENUE nacional).
+#
+# Listings: esquema de visualisations/listings.csv, con las alcaldías en
+# proporciones parecidas a las de la CDMX, coordenadas dentro de la alcaldía
+# (alrededor de establecimientos del DENUE) y precios con cola pesada.
+##
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from loaders import DENUE_PATH, DENUE_SEP
+
+CHUNK_SIZE = 500_000
+
+# Límites aproximados de la CDMX (latitud, longitud)
+CDMX_BOUNDS = {'lat': (19.05, 19.59), 'lon': (-99.37, -98.94)}
+
+LISTINGS_COLUMNS = [
+    'id', 'name', 'host_id', 'host_name', 'neighbourhood_group', 'neighbourhood',
+    'latitude', 'longitude', 'room_type', 'price', 'minimum_nights', 'number_of_reviews',
+    'last_review', 'reviews_per_month', 'calculated_host_listings_count', 'availability_365',
+    'number_of_reviews_ltm', 'license',
+]
+
+# Proporción aproximada de listings por alcaldía
+LISTINGS_SHARE = {
+    'Cuauhtémoc': 0.42, 'Miguel Hidalgo': 0.15, 'Benito Juárez': 0.13, 'Coyoacán': 0.06,
+    'Álvaro Obregón': 0.05, 'Tlalpan': 0.035, 'Iztapalapa': 0.025, 'Gustavo A. Madero': 0.025,
+    'Venustiano Carranza': 0.02, 'Cuajimalpa de Morelos': 0.02, 'Azcapotzalco': 0.012,
+    'Iztacalco': 0.012, 'Xochimilco': 0.01, 'La Magdalena Contreras': 0.005, 'Tláhuac': 0.002,
+    'Milpa Alta': 0.001,
+}
+
+# Multiplicador del precio típico por alcaldía
+PRICE_FACTOR = {
+    'Cuajimalpa de Morelos': 1.6, 'Miguel Hidalgo': 1.5, 'Milpa Alta': 1.4, 'Álvaro Obregón': 1.2,
+    'Cuauhtémoc': 1.1, 'Benito Juárez': 1.0, 'Coyoacán': 1.0, 'Tlalpan': 1.0,
+    'La Magdalena Contreras': 0.9, 'Xochimilco': 0.8, 'Azcapotzalco': 0.7, 'Venustiano Carranza': 0.7,
+    'Gustavo A. Madero': 0.6, 'Iztacalco': 0.6, 'Iztapalapa': 0.5, 'Tláhuac': 0.5,
+}
+
+ROOM_TYPES = {'Entire home/apt': 0.60, 'Private room': 0.36, 'Hotel room': 0.02, 'Shared room': 0.02}
+ROOM_FACTOR = {'Entire home/apt': 1.0, 'Private room': 0.45, 'Hotel room': 1.2, 'Shared room': 0.3}
+HOST_NAMES = np.array(['Ana', 'Luis', 'María', 'José', 'Carmen', 'Jorge', 'Sofía', 'Diego', 'Lucía', 'Pablo'])
+
+_TEMPLATES = {}
+
+
+def denue_template(path=DENUE_PATH):
+    """DENUE de referencia como texto, tal como viene en el archivo."""
+    if path not in _TEMPLATES:
+        _TEMPLATES[path] = pd.read_csv(path, sep=DENUE_SEP, dtype=str, keep_default_na=False)
+    return _TEMPLATES[path]
+
+
+def _chunk_rngs(rows, seed, chunk_size):
+    """(inicio, tamaño, generador) de cada bloque; cada bloque tiene su propia semilla."""
+    n_chunks = math.ceil(rows / chunk_size) if rows else 0
+    for i, seq in enumerate(np.random.SeedSequence(seed).spawn(n_chunks)):
+        start = i * chunk_size
+        yield start, min(chunk_size, rows - start), np.random.default_rng(seq)
+
+
+def denue_chunks(rows, seed=0, chunk_size=CHUNK_SIZE, template=DENUE_PATH):
+    """Bloques de renglones sintéticos del DENUE (dataframes de texto)."""
+    base = denue_template(template)
+    lat = base['latitud'].astype(float).to_numpy()
+    lon = base['longitud'].astype(float).to_numpy()
+    variants = math.ceil(math.sqrt(max(rows / len(base), 1)))
+
+    for start, n, rng in _chunk_rngs(rows, seed, chunk_size):
+        idx = rng.integers(0, len(base), n)
+        df = base.iloc[idx].reset_index(drop=True)
+        ids = pd.Series(np.arange(start + 1, start + n + 1)).astype(str)
+        df['nom_estab'] = (df['nom_estab'] + ' ' + ids).to_numpy()
+        df['numero_ext'] = rng.integers(1, 2000, n).astype(str)
+        v = rng.integers(0, variants, n)
+        suffix = np.where(v > 0, ' ' + pd.Series(v).astype(str), '')
+        df['nomb_asent'] = (df['nomb_asent'] + suffix).to_numpy()
+        df['latitud'] = np.round(lat[idx] + rng.normal(0, 0.003, n), 10)
+        df['longitud'] = np.round(lon[idx] + rng.normal(0, 0.003, n), 10)
+        yield df
+
+
+def listings_chunks(rows, seed=0, chunk_size=CHUNK_SIZE, template=DENUE_PATH):
+    """Bloques de listings sintéticos con el esquema de visualisations/listings.csv."""
+    base = denue_template(template)
+    names = np.array(list(LISTINGS_SHARE))
+    share = np.array(list(LISTINGS_SHARE.values()))
+    share = share / share.sum()
+
+    # Coordenadas del DENUE agrupadas por alcaldía para muestrear alrededor de ellas
+    order = base['municipio'].map({a: i for i, a in enumerate(names)}).to_numpy()
+    sort = np.argsort(order, kind='stable')
+    lat = base['latitud'].astype(float).to_numpy()[sort]
+    lon = base['longitud'].astype(float).to_numpy()[sort]
+    counts = np.bincount(order, minlength=len(names))
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    rooms = np.array(list(ROOM_TYPES))
+    room_p = np.array(list(ROOM_TYPES.values()))
+    price_factor = np.array([PRICE_FACTOR[a] for a in names])
+    room_factor = np.array([ROOM_FACTOR[r] for r in rooms])
+    last_day = np.datetime64('2021-12-25')
+
+    for start, n, rng in _chunk_rngs(rows, seed, chunk_size):
+        alc = rng.choice(len(names), n, p=share)
+        pick = offsets[alc] + (rng.random(n) * counts[alc]).astype(np.int64)
+        room = rng.choice(len(rooms), n, p=room_p)
+
+        # Precio log-normal por alcaldía y tipo de habitación, con una cola de Pareto
+        price = np.exp(rng.normal(np.log(900), 0.75, n)) * price_factor[alc] * room_factor[room]
+        tail = rng.random(n) < 0.01
+        price[tail] *= 1 + rng.pareto(1.2, tail.sum())
+        price = np.maximum(np.round(price), 80).astype(np.int64)
+
+        reviews = rng.negative_binomial(0.5, 0.02, n)
+        days_ago = rng.integers(0, 3 * 365, n)
+        has_reviews = reviews > 0
+        months = np.maximum(rng.integers(1, 96, n), 1)
+        ids = np.arange(start + 1, start + n + 1)
+
+        df = pd.DataFrame({
+            'id': ids,
+            'name': 'Alojamiento ' + pd.Series(ids).astype(str),
+            'host_id': rng.integers(1, 400_000_000, n),
+            'host_name': HOST_NAMES[rng.integers(0, len(HOST_NAMES), n)],
+            'neighbourhood_group': np.nan,
+            'neighbourhood': names[alc],
+            'latitude': np.round(np.clip(lat[pick] + rng.normal(0, 0.008, n), *CDMX_BOUNDS['lat']), 5),
+            'longitude': np.round(np.clip(lon[pick] + rng.normal(0, 0.008, n), *CDMX_BOUNDS['lon']), 5),
+            'room_type': rooms[room],
+            'price': price,
+            'minimum_nights': rng.geometric(0.45, n),
+            'number_of_reviews': reviews,
+            'last_review': np.where(has_reviews, (last_day - days_ago).astype(str), ''),
+            'reviews_per_month': np.where(has_reviews, np.round(reviews / months, 2), np.nan),
+            'calculated_host_listings_count': np.minimum(rng.zipf(2.0, n), 500),
+            'availability_365': rng.integers(0, 366, n),
+            'number_of_reviews_ltm': rng.binomial(reviews, 0.3),
+            'license': np.nan,
+        })
+        yield df[LISTINGS_COLUMNS]
+
+
+def write_csv(chunks, path, sep=','):
+    """Escribe los bloques en `path` conforme se generan; regresa el total de renglones.
+
+    Se usa el escritor de CSV de pyarrow, mucho más rápido que DataFrame.to_csv.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    total = 0
+    writer = None
+    try:
+        for df in chunks:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pa_csv.CSVWriter(tmp, table.schema, write_options=pa_csv.WriteOptions(delimiter=sep))
+            writer.write_table(table)
+            total += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp, path)
+    return total
+
+
+def generate_denue(path, rows, seed=0, chunk_size=CHUNK_SIZE):
+    return write_csv(denue_chunks(rows, seed, chunk_size), path, sep=DENUE_SEP)
+
+
+def generate_listings(path, rows, seed=0, chunk_size=CHUNK_SIZE):
+    return write_csv(listings_chunks(rows, seed, chunk_size), path)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Generador de datos sintéticos del DENUE y de Inside Airbnb.')
+    parser.add_argument('dataset', choices=['denue', 'listings'])
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    generate = generate_denue if args.dataset == 'denue' else generate_listings
+    total = generate(args.out, args.rows, args.seed, args.chunk_size)
+    print(f'{total:,} renglones en {args.out} ({time.perf_counter() - t:.1f} s)')
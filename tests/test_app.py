@@ -0,0 +1,65 @@
+##
+# Pruebas de la página con streamlit.testing (AppTest)
+##
+# Ejecutan la página completa en el mismo proceso, así que comparten el caché
+# de st.cache_resource entre ejecuciones como la app desplegada.
+#
+#   python -m pytest tests
+##
+import os
+import shutil
+import sys
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGE = os.path.join(ROOT, '08_listings_analisis_cdmx_stl_course_p1.py')
+sys.path.insert(0, ROOT)
+
+
+def cleaning_report(at):
+    """Reporte de la limpieza de colonias (la tabla con la regla 'similares')."""
+    for df in at.dataframe:
+        if 'regla' in df.value.columns and 'similares' in set(df.value['regla']):
+            return df.value.set_index('regla')
+    raise AssertionError('la página no mostró el reporte de limpieza')
+
+
+@pytest.fixture
+def merges_file(monkeypatch):
+    """Ruta del archivo de fusiones; al terminar se deja como estaba."""
+    monkeypatch.chdir(ROOT)
+    from cleaning import MERGES_PATH
+    backup = MERGES_PATH + '.prueba'
+    if os.path.exists(MERGES_PATH):
+        shutil.copy2(MERGES_PATH, backup)
+    yield MERGES_PATH
+    if os.path.exists(backup):
+        shutil.move(backup, MERGES_PATH)
+    elif os.path.exists(MERGES_PATH):
+        os.remove(MERGES_PATH)
+
+
+def test_merges_apply_on_next_rerun(merges_file):
+    if os.path.exists(merges_file):
+        os.remove(merges_file)
+    at = AppTest.from_file(PAGE, default_timeout=600)
+    at.run()
+    assert not at.exception
+    antes = cleaning_report(at)
+    assert antes.loc['similares', 'renglones'] == 0
+
+    # Se aprueba una fusión con la app corriendo: una colonia de la tabla de conteos
+    from pipeline import materialize
+    cubo = materialize('cubo_limpio')
+    fila = cubo.groupby(['alcaldia', 'nomb_asent'], observed=True)['count'].sum().idxmax()
+    with open(merges_file, 'w') as f:
+        f.write('alcaldia,nomb_asent,canonica,count,similitud,aprobado\n')
+        f.write(f'{fila[0]},{fila[1]},COLONIA DE PRUEBA,,,1\n')
+
+    at.run()
+    assert not at.exception
+    despues = cleaning_report(at)
+    assert despues.loc['similares', 'categorias'] > 0
+    assert despues.loc['similares', 'renglones'] > 0
@@ -21,13 +21,21 @@ st.set_page_config(
      initial_sidebar_state="auto"
  )
 
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
 import streamlit as st
-import pydeck as pdk
 #from scipy import stats
-import numpy as np 
+# plotly, pydeck, etc. se importan en la sección que los usa (ver figures.py)
 
 
 ##
@@ -61,6 +69,7 @@ footer:after {
 ##
 
 def header(text):
+    mark(text)
     BG_COLOR = "#FCF3CF"
     FONT_COLOR = "#2E4053"
     st.markdown(f'''
@@ -75,12 +84,259 @@ def footer(text):
     ''', unsafe_allow_html=True)
 
 def subheader(text):
+    mark(text)
     BG_COLOR = "#E6E6E6"
     FONT_COLOR = "#6E6E6E"
     font = "sans-serif"
     st.markdown(f'''
     <p style="background-color:{BG_COLOR};color:{FONT_COLOR};font-size:26px;border-radius:2%;">{text}</p>
     ''', unsafe_allow_html=True)
+
+##
+# Medición de desempeño por sección
+##
+# Se activa con la variable de ambiente APP_PROFILE=1 o, si APP_PROFILE_QUERY=1
+# lo permite, con ?debug=1 en el URL (sin ese permiso cualquier visitante
+# podría activar la medición para todo el proceso).
+# Para cada sección se registra el tiempo real, el tiempo de CPU del hilo del
+# script y el pico de memoria asignada (tracemalloc) respecto al inicio de la
+# sección. Los resultados se muestran en la barra lateral y se agregan como
+# líneas JSON a PROFILE_LOG.
+#
+#   with section('Carga DENUE'):       # sección explícita, se pueden anidar
+#       ...
+#   @timed('Cubo')                     # lo mismo para una función
+#   mark('AirBnB: dashboard')          # cierra la marca anterior y abre otra
+#
+# header() y subheader() llaman a mark() con su texto. tracemalloc mide todo
+# el proceso, así que se activa solamente mientras hay ejecuciones medidas y la
+# memoria de una sección se reporta solamente si no hay otra ejecución medida
+# al mismo tiempo (si no, mem_peak_kb queda nulo).
+PROFILE_LOG = os.environ.get('APP_PROFILE_LOG', 'logs/perfil.jsonl')
+
+# Una ejecución medida que no terminó (p. ej. la sesión se cerró) deja de contar después de esto
+PROFILE_STALE_S = 600
+
+# Estado de la ejecución actual; cada ejecución del script corre en su hilo
+_RUN = threading.local()
+
+# Ejecuciones medidas en curso: sesión -> inicio; una nueva ejecución de la sesión reemplaza a la anterior
+_PROFILED = {}
+_PROFILED_LOCK = threading.Lock()
+
+def profile_enabled():
+    if os.environ.get('APP_PROFILE') == '1':
+        return True
+    if os.environ.get('APP_PROFILE_QUERY') != '1':
+        return False
+    try:
+        return st.query_params.get('debug') == '1'
+    except Exception:
+        return False
+
+def _session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else _RUN.run_id
+
+def _profiled_alone():
+    """True si la ejecución actual es la única medida; así su pico de memoria no se mezcla con otras."""
+    with _PROFILED_LOCK:
+        return list(_PROFILED) == [_RUN.session]
+
+def _profile_end():
+    """Da por terminada la ejecución; sin ejecuciones medidas se detiene tracemalloc."""
+    with _PROFILED_LOCK:
+        _PROFILED.pop(_RUN.session, None)
+        if not _PROFILED and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+def profile_start():
+    """Inicia la medición de una ejecución; se llama al principio de la página."""
+    _RUN.enabled = profile_enabled()
+    _RUN.run_id = uuid.uuid4().hex[:8]
+    _RUN.records = []
+    _RUN.stack = []
+    _RUN.mark = None
+    _RUN.t0 = time.perf_counter()
+    _RUN.session = _session_id()
+    with _PROFILED_LOCK:
+        # Una ejecución anterior de la sesión interrumpida por un rerun ya no cuenta
+        _PROFILED.pop(_RUN.session, None)
+        now = time.monotonic()
+        for session, started in list(_PROFILED.items()):
+            if now - started > PROFILE_STALE_S:
+                del _PROFILED[session]
+        if _RUN.enabled:
+            _PROFILED[_RUN.session] = now
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        elif not _PROFILED and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+@contextmanager
+def section(name):
+    if not getattr(_RUN, 'enabled', False):
+        yield
+        return
+    current, peak = tracemalloc.get_traced_memory()
+    if _RUN.stack:
+        # El pico de la sección que nos contiene se guarda antes de reiniciarlo
+        _RUN.stack[-1]['peak'] = max(_RUN.stack[-1]['peak'], peak)
+    # reset_peak es de todo el proceso: con otra ejecución medida no se reinicia ni se reporta la memoria
+    alone = _profiled_alone()
+    if alone:
+        tracemalloc.reset_peak()
+    frame = {'start': current, 'peak': current, 'alone': alone}
+    _RUN.stack.append(frame)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    start = wall - _RUN.t0
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        _, peak = tracemalloc.get_traced_memory()
+        _RUN.stack.pop()
+        frame['peak'] = max(frame['peak'], peak)
+        frame['alone'] = frame['alone'] and _profiled_alone()
+        if _RUN.stack:
+            _RUN.stack[-1]['peak'] = max(_RUN.stack[-1]['peak'], frame['peak'])
+        _RUN.records.append({
+            'section': name,
+            'depth': len(_RUN.stack),
+            'start_ms': round(1000 * start, 2),
+            'wall_ms': round(1000 * wall, 2),
+            'cpu_ms': round(1000 * cpu, 2),
+            'mem_peak_kb': round((frame['peak'] - frame['start']) / 1024, 1) if frame['alone'] else None,
+        })
+
+def timed(name=None):
+    """Decorador: mide cada llamada a la función como una sección."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with section(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _close_mark():
+    if _RUN.mark is not None and len(_RUN.stack) == _RUN.mark[1]:
+        _RUN.mark[0].__exit__(None, None, None)
+        _RUN.mark = None
+
+def mark(name):
+    """Cierra la sección abierta por el último mark() y abre otra con `name`."""
+    if not getattr(_RUN, 'enabled', False):
+        return
+    _close_mark()
+    # Dentro de una sección explícita no se abren marcas
+    if _RUN.mark is None and not _RUN.stack:
+        ctx = section(name)
+        ctx.__enter__()
+        _RUN.mark = (ctx, len(_RUN.stack))
+
+def profile_report():
+    """Muestra el perfil de la ejecución en la barra lateral y lo guarda en PROFILE_LOG."""
+    if not getattr(_RUN, 'enabled', False):
+        return
+    _close_mark()
+    _profile_end()
+    records = _RUN.records
+    ts = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(PROFILE_LOG) or '.', exist_ok=True)
+    with open(PROFILE_LOG, 'a') as f:
+        for r in records:
+            f.write(json.dumps({'ts': ts, 'run': _RUN.run_id, **r}, ensure_ascii=False) + '\n')
+
+    with st.sidebar.expander('Perfil de la ejecución', expanded=True):
+        df = pd.DataFrame(records)
+        if len(df):
+            df = df.sort_values('start_ms')
+            df['section'] = ['· ' * d + n for n, d in zip(df['section'], df['depth'])]
+            st.metric('Tiempo total (s)', f"{df.loc[df['depth'] == 0, 'wall_ms'].sum() / 1000:.2f}")
+            st.dataframe(df.drop(columns='depth'), hide_index=True)
+
+##
+# Tablas paginadas
+##
+# st.write / st.dataframe mandan la tabla completa al navegador. paged_table
+# manda solamente la página visible: el orden (argsort por columna) y el texto
+# de búsqueda se calculan una vez por tabla y versión y se guardan en el
+# servidor; la búsqueda filtra ese orden y la página es un slice de él.
+# Cada tabla es un st.fragment, así que cambiar de página, de orden o de
+# búsqueda solamente vuelve a ejecutar la tabla.
+#
+#   paged_table(df, 'colonias', version, sort=('count', False))
+#
+# `key` identifica la tabla (y sus controles) y `version` cambia cuando cambian
+# sus datos (p. ej. el hash del archivo o la versión del snapshot).
+PAGE_SIZE = 50
+
+@st.cache_resource(max_entries=64)
+def _table_order(key, version, column, ascending, _df):
+    if column is None:
+        return np.arange(len(_df))
+    ordered = _df[[column]].reset_index(drop=True).sort_values(column, ascending=ascending, kind='stable',
+                                                               na_position='last')
+    return ordered.index.to_numpy()
+
+@st.cache_resource(max_entries=64)
+def _table_text(key, version, _df):
+    """Texto en minúsculas de las columnas de texto de cada renglón, para buscar."""
+    columns = [c for c in _df.columns if not pd.api.types.is_numeric_dtype(_df[c])]
+    if not columns:
+        return None
+    text = _df[columns[0]].astype(str)
+    for c in columns[1:]:
+        text = text + '\t' + _df[c].astype(str)
+    return text.str.lower().to_numpy()
+
+def table_rows(df, key, version, column=None, ascending=True, search=''):
+    """Posiciones de los renglones de `df` ordenados por `column` que contienen `search`."""
+    order = _table_order(key, version, column, ascending, df)
+    search = search.strip().lower()
+    if search:
+        text = _table_text(key, version, df)
+        if text is None:
+            return order[:0]
+        found = pd.Series(text).str.contains(search, regex=False).to_numpy()
+        order = order[found[order]]
+    return order
+
+@st.fragment
+def paged_table(df, key, version=None, sort=None, page_size=PAGE_SIZE):
+    """Tabla paginada de `df` (o de una Serie); `sort` es (columna, ascendente)."""
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    columns = list(df.columns)
+    column, ascending = sort or (None, True)
+
+    col_q, col_s, col_o = st.columns([3, 2, 1])
+    search = col_q.text_input('Buscar', key=f'{key}_buscar')
+    options = ['(original)'] + columns
+    column = col_s.selectbox('Ordenar por', options, key=f'{key}_orden',
+                             index=options.index(column) if column in columns else 0)
+    ascending = col_o.toggle('Ascendente', value=ascending, key=f'{key}_asc')
+    column = None if column == '(original)' else column
+
+    rows = table_rows(df, key, version, column, ascending, search)
+    pages = max(-(-len(rows) // page_size), 1)
+    # Al cambiar la búsqueda o el orden se regresa a la primera página
+    view = (search, column, ascending, version)
+    if st.session_state.get(f'{key}_vista') != view or st.session_state.get(f'{key}_pagina', 1) > pages:
+        st.session_state[f'{key}_vista'] = view
+        st.session_state[f'{key}_pagina'] = 1
+    page = st.number_input(f'Página (de {pages:,})', min_value=1, max_value=pages, key=f'{key}_pagina')
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[rows[start:start + page_size]], hide_index=True)
+    st.caption(f'Renglones {min(start + 1, len(rows)):,} a {min(start + page_size, len(rows)):,} '
+               f'de {len(rows):,} (de {len(df):,} en total)')
+
+##
+# Tema y fábrica de figuras (ver figures.py)
+##
+from figures import *
 ##
 # Layout
 ##